@@ -1,111 +1,567 @@
+import hashlib
+import os
 import pickle as pk
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
 import pandas as pd
 import numpy as np
-import boto3
+from SLR_store import LAND_FILL_VALUE, axis_slice, choose_pyramid_level, is_store, level_path, open_store, \
+    store_fingerprint, time_slice
+from SLR_s3 import DEFAULT_BUCKET, S3_PICKLE_KEYS, S3_STORE_PREFIXES, get_s3_loader
+from SLR_instrument import instrumented
 
+@instrumented(rows=lambda result: len(result[1]))
 def load_initial_data(year, 
                       start_day = '2021-01-01',
                       end_day = '2021-12-31',
                       n_days = 30,
-                      mode = 'east_coast'):
+                      mode = 'east_coast',
+                      point_budget = None,
+                      use_cache = True):
     state_data = get_state_data(year=year)
-    SLR_data = dic_to_pd(mode = mode, year = year)
-    df_for_visualization = PP_df(SLR_data, start_day, end_day, n_days)
-    return state_data, df_for_visualization
-
-def load_pk_s3(bucket_name = 'competitions23', mode = 'east_coast'):
-    if mode == 'east_coast':
-        key = 'slr/slr_eastcost_21_23.pkl'
-    elif mode == 'all_us':
-        key =  'slr/slr_all_us_11_21.pkl'
-    s3client = boto3.client('s3')
-    response = s3client.get_object(Bucket=bucket_name, 
-                                   Key=key)
-    body = response['Body'].read()
-    data = pk.loads(body)
+    if not use_cache:
+        SLR_data = load_cube(mode = mode, start_day = f'{year}-01-01', end_day = f'{year}-12-31',
+                             point_budget = point_budget)
+        return state_data, PP_df(SLR_data, start_day, end_day, n_days)
+
+    # Repeated queries hit the processed result, other windows of the same year reuse the loaded cube.
+    # The keys carry the data version, so a re-ingested store is never served from an old entry.
+    start_day = pd.to_datetime(start_day).strftime('%Y-%m-%d')
+    end_day = pd.to_datetime(end_day).strftime('%Y-%m-%d')
+    version = data_fingerprint(mode)
+    def process():
+        # The full year cube stays in memory only, pickling it to disk would stall this request
+        SLR_data = SLR_CACHE.get_or_compute(
+            ('cube', mode, version, year, point_budget),
+            lambda: load_cube(mode = mode, start_day = f'{year}-01-01', end_day = f'{year}-12-31',
+                              point_budget = point_budget),
+            disk = False)
+        return PP_df(SLR_data, start_day, end_day, n_days, compact = True)
+    # The cache keeps the compact SLRFrame, every call gets its own DataFrame
+    df_for_visualization = SLR_CACHE.get_or_compute(
+        ('rate_of_change', mode, version, year, start_day, end_day, n_days, point_budget), process)
+    return state_data, df_for_visualization.to_frame()
+
+_INCREMENTAL = {}
+
+@instrumented(rows=lambda result: len(result[1]))
+def load_window_data(start_day,
+                     end_day,
+                     n_days = 30,
+                     mode = 'east_coast',
+                     point_budget = None):
+    """
+    Like `load_initial_data`, but for any window of the whole record of `mode`, evaluated incrementally.
+
+    Moving the window only computes the time blocks that newly enter it (see IncrementalRateOfChange).
+    The state data is the one of the start year.
+    """
+    key = (mode, point_budget)
+    version = data_fingerprint(mode)
+    if _INCREMENTAL.get(key, (None, None))[0] != version:
+        # First use, or the store was re-ingested since the blocks were computed
+        path = STORE_PATHS[mode]
+        if is_store(path):
+            if point_budget is not None:
+                path = level_path(path, choose_pyramid_level(path, point_budget))
+            source = open_store(path)
+        else:
+            source = load_cube(mode = mode)
+        _INCREMENTAL[key] = (version, IncrementalRateOfChange(source))
+    state_data = get_state_data(year=pd.to_datetime(start_day).year)
+    return state_data, _INCREMENTAL[key][1].window(start_day, end_day, n_days)
+
+STORE_PATHS = {'east_coast': '../data/slr_eastcost_21_23',
+               'all_us': '../data/slr_all_us_11_21'}
+PICKLE_PATHS = {'east_coast': '../data/slr_eastcost_21_23.pkl',
+                'all_us': '../data/slr_all_us_11_21.pkl'}
+
+def data_fingerprint(mode = 'east_coast'):
+    """
+    Version of the local data of `mode` for cache keys: the store's (see SLR_store.store_fingerprint),
+    else the legacy pickle's modification time and size, None when neither exists.
+    """
+    if is_store(STORE_PATHS[mode]):
+        return store_fingerprint(STORE_PATHS[mode])
+    try:
+        stat = os.stat(PICKLE_PATHS[mode])
+    except OSError:
+        return None
+    return f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+@instrumented(rows=None)
+def load_pk_s3(bucket_name = DEFAULT_BUCKET, mode = 'east_coast', endpoint_url = None):
+    # Parallel range download into the local S3 cache, then unpickled from the file rather than from a copy in memory
+    path = get_s3_loader(bucket_name, endpoint_url).fetch(S3_PICKLE_KEYS[mode])
+    with open(path, 'rb') as f:
+        data = pk.load(f)
     return data
 
+@instrumented()
+def load_cube_s3(mode = 'east_coast', start_day = None, end_day = None, lat_range = None, lon_range = None,
+                 point_budget = None, bucket_name = DEFAULT_BUCKET, endpoint_url = None):
+    """
+    Like `load_cube`, but from the chunked store of `mode` in S3.
+
+    Only the chunks overlapping the window are downloaded, with parallel range requests, and they
+    are kept in the local S3 cache (see SLR_s3.S3Loader) for later calls.
+
+    Parameters:
+    - mode: 'east_coast' or 'all_us', resolved with SLR_s3.S3_STORE_PREFIXES.
+    - start_day, end_day, lat_range, lon_range, point_budget: See `load_cube`.
+    - bucket_name: Bucket of the store. Defaults to SLR_s3.DEFAULT_BUCKET.
+    - endpoint_url: S3 compatible endpoint, e.g. MinIO. Defaults to the SLR_S3_ENDPOINT_URL variable or AWS.
+    """
+    store = get_s3_loader(bucket_name, endpoint_url).open_store(
+        S3_STORE_PREFIXES[mode], start_day, end_day, point_budget = point_budget,
+        lat_range = lat_range, lon_range = lon_range)
+    return SLRCube.from_dict(store.select(start_day, end_day, lat_range, lon_range))
+
+@instrumented(rows=None)
 def load_pk_local(mode = 'east_coast'):
-    if mode == 'east_coast':
-        key = '../data/slr_eastcost_21_23.pkl'
-    elif mode == 'all_us':
-        key =  '../data/slr_all_us_11_21.pkl'
-    with open(key, 'rb') as f:
+    with open(PICKLE_PATHS[mode], 'rb') as f:
         data = pk.load(f)
     return data
-def dic_to_pd(year, mode = 'east_coast'):
-    data = load_pk_local(mode = mode)
-    time = data['time']
-    latitude = data['latitude']
-    longitude = data['longitude']
-    adt = data['adt']
-    # Since your dataset likely represents a 2D grid of points over multiple times, 
-    # we'll need to repeat the time array to match the number of latitude and longitude points
-    time_repeated = np.repeat(time, latitude.size * longitude.size)
-
-    # Create a meshgrid for latitude and longitude, then flatten them for the DataFrame
-    lon, lat = np.meshgrid(longitude, latitude)
-    lon_flat = lon.flatten()
-    lat_flat = lat.flatten()
-
-    # Repeat latitude and longitude coordinates for each time step
-    lat_repeated = np.tile(lat_flat, len(time))
-    lon_repeated = np.tile(lon_flat, len(time))
-
-    adt_flat = adt.flatten().data  # Or another method to match DataFrame's structure
-
-    # Now combine everything into a DataFrame
-    df = pd.DataFrame({
-        'Time': time_repeated,
-        'Latitude': lat_repeated,
-        'Longitude': lon_repeated, 
-        'adt': adt_flat,
+
+
+class SLRCube:
+    """
+    Dense (time, latitude, longitude) sea level cube.
+
+    The coordinate axes and the masked 'adt' array are kept as NumPy arrays. Time windows and
+    bounding boxes are answered by index slicing, and only the selected subset is expanded to
+    the long format DataFrame when `to_long` is called.
+
+    Parameters:
+    - time: 1D array of timestamps (ascending).
+    - latitude: 1D array of latitudes.
+    - longitude: 1D array of longitudes.
+    - adt: (time, latitude, longitude) array, optionally masked over land.
+    """
+    def __init__(self, time, latitude, longitude, adt):
+        self.time = np.asarray(time).astype('datetime64[ns]')
+        self.latitude = np.ma.getdata(latitude)
+        self.longitude = np.ma.getdata(longitude)
+        self.adt = adt
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a cube from the {'time', 'latitude', 'longitude', 'adt'} dictionary of the pickles."""
+        return cls(data['time'], data['latitude'], data['longitude'], data['adt'])
+
+    @classmethod
+    def from_long(cls, df):
+        """Build a cube from a long (Time, Latitude, Longitude, adt) DataFrame; missing entries become land."""
+        time, t_idx = np.unique(pd.to_datetime(df['Time']).to_numpy(), return_inverse=True)
+        latitude, lat_idx = np.unique(df['Latitude'].to_numpy(), return_inverse=True)
+        longitude, lon_idx = np.unique(df['Longitude'].to_numpy(), return_inverse=True)
+        adt_values = df['adt'].to_numpy()
+        adt = np.full((time.size, latitude.size, longitude.size), LAND_FILL_VALUE, dtype=adt_values.dtype)
+        adt[t_idx, lat_idx, lon_idx] = adt_values
+        return cls(time, latitude, longitude, adt)
+
+    @property
+    def shape(self):
+        return (self.time.size, self.latitude.size, self.longitude.size)
+
+    def __len__(self):
+        return self.time.size * self.latitude.size * self.longitude.size
+
+    def select(self, start_day=None, end_day=None, lat_range=None, lon_range=None):
+        """
+        Select a time window and/or a bounding box without copying the data.
+
+        Parameters:
+        - start_day, end_day: Inclusive window bounds in YYYY-MM-DD format (None for open ended).
+        - lat_range, lon_range: Inclusive (min, max) coordinate bounds (None for the full axis).
+
+        Returns:
+        - A new SLRCube viewing the selected subset.
+        """
+        t_slice = time_slice(self.time, start_day, end_day)
+        lat_slice = axis_slice(self.latitude, lat_range)
+        lon_slice = axis_slice(self.longitude, lon_range)
+        return SLRCube(self.time[t_slice],
+                       self.latitude[lat_slice],
+                       self.longitude[lon_slice],
+                       self.adt[t_slice, lat_slice, lon_slice])
+
+    def copy(self):
+        """Return a cube owning copies of its arrays, e.g. to release the record a selection views."""
+        return SLRCube(self.time.copy(), self.latitude.copy(), self.longitude.copy(), self.adt.copy())
+
+    def to_long(self):
+        """Expand the cube to the long (Time, Latitude, Longitude, adt) DataFrame built by `dic_to_pd`."""
+        n_cells = self.latitude.size * self.longitude.size
+        lon, lat = np.meshgrid(self.longitude, self.latitude)
+        df = pd.DataFrame({
+            'Time': np.repeat(self.time, n_cells),
+            'Latitude': np.tile(lat.ravel(), self.time.size),
+            'Longitude': np.tile(lon.ravel(), self.time.size),
+            'adt': np.ma.getdata(self.adt).ravel(),
+        })
+        df['Time'] = pd.to_datetime(df['Time'])
+        return df
+
+
+class SLRFrame:
+    """
+    Compact columnar form of a processed result, convertible to the DataFrame returned by `PP_df`.
+
+    Rows come in runs of one grid cell, as in PP_df. Every run is stored once as int16 indices
+    into the latitude and longitude axes and a row count, and every row as an index into the
+    distinct day offsets from `origin`, float32 'adt' and rate of change values and one bit of a
+    packed validity mask. The mask is False on the rows without n_days of history, which
+    `to_frame` fills with 0 and flags in 'Has_History'. A row takes 9 to 10 bytes instead of the
+    33 to 41 bytes of the DataFrame.
+
+    Parameters:
+    - latitude, longitude: Coordinate axes of the grid.
+    - origin: Timestamp of day offset 0 (the data is daily).
+    - cell_lat, cell_lon: Axis indices of the cell of every run.
+    - counts: Number of rows of every run.
+    - days: Distinct day offsets of the rows.
+    - day_idx: Index into `days` of every row.
+    - adt, rate: 'adt' and 'Rate_of_Change' of every row.
+    - valid: Boolean array, False on the rows whose rate of change is undefined.
+    - attrs: Metadata given to the DataFrame's `attrs` (see `set_cadence`).
+    """
+    def __init__(self, latitude, longitude, origin, cell_lat, cell_lon, counts, days, day_idx, adt, rate, valid,
+                 attrs=None):
+        self.latitude = np.ma.getdata(latitude)
+        self.longitude = np.ma.getdata(longitude)
+        self.origin = np.datetime64(origin, 'ns')
+        self.cell_lat = np.asarray(cell_lat, dtype=np.int16)
+        self.cell_lon = np.asarray(cell_lon, dtype=np.int16)
+        self.counts = _small_int(counts)
+        self.days = _small_int(days)
+        self.day_idx = _small_int(day_idx, unsigned=True)
+        self.adt = np.asarray(adt, dtype=np.float32)
+        self.rate = np.asarray(rate, dtype=np.float32)
+        self._valid = np.packbits(np.asarray(valid, dtype=bool))
+        self.attrs = dict(attrs or {})
+
+    @classmethod
+    def from_cells(cls, time, latitude, longitude, cell, time_idx, adt, rate, attrs=None):
+        """
+        Build a frame from the flat (latitude, longitude) cell index and the time index of every row.
+
+        Rows whose rate is NaN are marked invalid.
+        """
+        time = np.asarray(time).astype('datetime64[ns]')
+        starts = np.flatnonzero(np.diff(cell, prepend=-1)) if cell.size else np.array([], dtype=int)
+        counts = np.diff(np.append(starts, cell.size))
+        cell_lat, cell_lon = np.divmod(cell[starts], np.ma.getdata(longitude).size)
+        origin = time[0] if time.size else np.datetime64(0, 'ns')
+        days, day_idx = np.unique((time[time_idx] - origin) // np.timedelta64(1, 'D'), return_inverse=True)
+        return cls(latitude, longitude, origin, cell_lat, cell_lon, counts, days, day_idx.ravel(), adt, rate,
+                   ~np.isnan(rate), attrs)
+
+    @property
+    def valid(self):
+        return np.unpackbits(self._valid, count=self.day_idx.size).astype(bool)
+
+    @property
+    def nbytes(self):
+        arrays = (self.latitude, self.longitude, self.cell_lat, self.cell_lon, self.counts,
+                  self.days, self.day_idx, self.adt, self.rate, self._valid)
+        return sum(array.nbytes for array in arrays)
+
+    def __len__(self):
+        return self.day_idx.size
+
+    def to_frame(self):
+        """Expand to the DataFrame of `PP_df`, with its 'Has_History' column and `attrs`."""
+        df = _processed_frame(self.origin + self.days.astype('timedelta64[D]')[self.day_idx],
+                              np.repeat(self.latitude[self.cell_lat], self.counts),
+                              np.repeat(self.longitude[self.cell_lon], self.counts),
+                              self.adt.astype(np.float64), self.rate.astype(np.float64), self.valid)
+        df.attrs.update(self.attrs)
+        return df
+
+
+def _processed_frame(time, latitude, longitude, adt, rate, has_history=None):
+    # Rows without n_days of history keep the legacy 0 rate and are flagged in 'Has_History'
+    if has_history is None:
+        has_history = ~np.isnan(rate)
+    return pd.DataFrame({
+        'Time': time,
+        'Latitude': latitude,
+        'Longitude': longitude,
+        'adt': adt,
+        'Rate_of_Change': np.where(has_history, rate, 0),
+        'Has_History': has_history,
     })
-    # Ensure 'Time' is in datetime format (if not already)
-    df['Time'] = pd.to_datetime(df['Time'])
 
-    # Filter DataFrame for entries within the specified year
-    start_date = pd.to_datetime(f'{year}-01-01')
-    end_date = pd.to_datetime(f'{year}-12-31')
-    
-    yearly_df = df[(df['Time'] >= start_date) & (df['Time'] <= end_date)]
+
+def _small_int(values, unsigned=False):
+    values = np.asarray(values)
+    if unsigned:
+        return values.astype(np.uint8 if values.size == 0 or values.max() < 2**8 else np.uint16 if values.max() < 2**16 else np.int64)
+    return values.astype(np.int16 if values.size == 0 or values.max() < 2**15 else np.int32)
+
+
+@instrumented()
+def load_cube(mode = 'east_coast', start_day = None, end_day = None, lat_range = None, lon_range = None,
+              point_budget = None):
+    """
+    Load the sea level data for `mode` as an SLRCube.
+
+    When the chunked store of `mode` exists only the chunks overlapping the window and bounding box
+    are read, otherwise the legacy pickle is loaded and sliced.
+
+    Parameters:
+    - mode: 'east_coast' or 'all_us'.
+    - start_day, end_day: Inclusive window bounds in YYYY-MM-DD format (None for open ended).
+    - lat_range, lon_range: Inclusive (min, max) coordinate bounds (None for the full axis).
+    - point_budget: Maximum number of grid cells wanted in the bounding box. When given, the finest
+      pyramid level of the store that fits is read. Defaults to None (full resolution).
+    """
+    path = STORE_PATHS[mode]
+    if is_store(path):
+        if point_budget is not None:
+            path = level_path(path, choose_pyramid_level(path, point_budget, lat_range, lon_range))
+        return SLRCube.from_dict(open_store(path).select(start_day, end_day, lat_range, lon_range))
+    cube = SLRCube.from_dict(load_pk_local(mode = mode))
+    # Copy the selection so a cached cube does not keep the whole record alive
+    return cube.select(start_day, end_day, lat_range, lon_range).copy()
+
+
+@instrumented()
+def dic_to_pd(year, mode = 'east_coast'):
+    # Select the year on the dense arrays and only expand that subset to the long format
+    yearly_df = load_cube(mode = mode, start_day = f'{year}-01-01', end_day = f'{year}-12-31').to_long()
 
     # Reduce the resolution 
 
     print(f"Number of entries in {year} is {len(yearly_df)}")
     return yearly_df
 
-def PP_df(df, start_day, end_day, n_days=1):
+@instrumented()
+def PP_df(df, start_day, end_day, n_days=1, compact=False):
     """
     Process a DataFrame to select data between start and end days, calculate the rate of change in 'adt'
     values over a specified number of days, and return a row entry every n days.
     
     Parameters:
-    - df: DataFrame containing the data.
+    - df: DataFrame or SLRCube containing the data.
     - start_day: The start day for selecting the data in YYYY-MM-DD format.
     - end_day: The end day for selecting the data in YYYY-MM-DD format.
     - n_days: The number of days over which to calculate the difference in 'adt' values. Defaults to 1.
+    - compact: Return an SLRFrame instead of the DataFrame. Defaults to False.
     
     Returns:
     - A DataFrame with the rate of change calculated over the specified number of days, with an entry every n days.
+      The rate is 0 on the rows without n_days of history, which 'Has_History' flags as False.
+      Its `attrs` hold 'n_days', 'start_day' and 'end_day' (see `set_cadence`).
     """
-    start_day = pd.to_datetime(start_day)
-    end_day = pd.to_datetime(end_day)
-    # Filter out land data and select data between start_day and end_day
-    sea_df = df[(df['adt'] > -2.147484e+07) & (df['Time'] >= start_day) & (df['Time'] <= end_day)]
-    sea_df['Time'] = pd.to_datetime(sea_df['Time'])
-    sea_df.sort_values(by=['Latitude', 'Longitude', 'Time'], inplace=True)
-    
-    # Calculate the difference in 'adt' values over n_days
-    sea_df['Rate_of_Change'] = sea_df.groupby(['Latitude', 'Longitude'])['adt'].diff(periods=n_days)
-    
-    # Instead of dropping NaNs, filter to include every n-th day's data
-    # This is achieved by resetting the index within each group and then filtering
-    sea_df = sea_df.groupby(['Latitude', 'Longitude']).apply(lambda x: x.iloc[n_days-1::n_days]).reset_index(drop=True)
-    sea_df.fillna(0, inplace=True)
+    if isinstance(df, SLRCube):
+        cube = df.select(start_day, end_day)
+    else:
+        start_day = pd.to_datetime(start_day)
+        end_day = pd.to_datetime(end_day)
+        time = pd.to_datetime(df['Time'])
+        cube = SLRCube.from_long(df[(time >= start_day) & (time <= end_day)])
+
+    # Cells are ordered by (Latitude, Longitude) and each cell's days by Time, as the groupby did
+    lon, lat = np.meshgrid(cube.longitude, cube.latitude)
+    lat_flat, lon_flat = lat.ravel(), lon.ravel()
+    cell_order = np.lexsort((lon_flat, lat_flat))
+    # The explicit cell count keeps windows without any day (e.g. past the end of the record) reshapable
+    adt = np.ma.getdata(cube.adt).reshape(cube.time.size, lat_flat.size)[:, cell_order]
+
+    cell, time_idx, adt_values, rate = rate_of_change(adt, n_days, missing=np.nan)
+    cell = cell_order[cell]
+    if compact:
+        sea_frame = SLRFrame.from_cells(cube.time, cube.latitude, cube.longitude, cell, time_idx, adt_values, rate)
+        return set_cadence(sea_frame, n_days, start_day, end_day)
+    sea_df = _processed_frame(cube.time[time_idx], lat_flat[cell], lon_flat[cell], adt_values, rate)
+    return set_cadence(sea_df, n_days, start_day, end_day)
+
+
+def set_cadence(sea_df, n_days, start_day, end_day):
+    """
+    Record the cadence and window of a processed DataFrame (or SLRFrame) in its `attrs`.
+
+    SLR_visualization.infer_n_days and the figure titles read them instead of recovering them from the rows.
+    """
+    sea_df.attrs.update({'n_days': int(n_days),
+                         'start_day': pd.to_datetime(start_day).strftime('%Y-%m-%d'),
+                         'end_day': pd.to_datetime(end_day).strftime('%Y-%m-%d')})
     return sea_df
 
 
+def has_history(sea_df):
+    """
+    Boolean mask of the rows of a processed DataFrame whose rate of change has n_days of history.
+
+    PP_df zero-fills the samples that have no earlier sample to difference with and flags them in
+    its 'Has_History' column. Frames without that column are taken as complete.
+    """
+    if 'Has_History' in sea_df:
+        return sea_df['Has_History'].to_numpy(dtype=bool)
+    return np.ones(len(sea_df), dtype=bool)
+
+
+def rate_of_change(adt, n_days=1, missing=0):
+    """
+    Batched n-day rate of change of a (time, cells) 'adt' array along the time axis.
+
+    Land is handled as a mask: entries at or below LAND_FILL_VALUE (or NaN) are skipped, so the
+    differences and the every n-th day subsampling run over each cell's sea days only, exactly
+    as the per cell groupby diff and iloc[n_days-1::n_days] did.
+
+    Parameters:
+    - adt: (time, cells) array of 'adt' values.
+    - n_days: The number of days over which to calculate the difference. Defaults to 1.
+    - missing: Rate given where fewer than n_days earlier sea days are available. Defaults to 0.
+
+    Returns:
+    - (cell, time_idx, adt, rate) arrays with one entry per selected day, ordered by cell then time.
+    """
+    values = np.ascontiguousarray(adt.T)
+    valid = values > LAND_FILL_VALUE
+    flat_idx = np.flatnonzero(valid)
+    values = values.ravel()[flat_idx]
+
+    # Rank of every sea day within its own cell
+    counts = valid.sum(axis=1)
+    cell_start = np.cumsum(counts) - counts
+    rank = np.arange(flat_idx.size) - np.repeat(cell_start, counts)
+
+    selected = np.flatnonzero((rank + 1) % n_days == 0)
+    rate = np.full(selected.size, missing, dtype=values.dtype)
+    has_history = rank[selected] >= n_days
+    current = selected[has_history]
+    rate[has_history] = values[current] - values[current - n_days]
+
+    n_times = adt.shape[0]
+    cell, time_idx = np.divmod(flat_idx[selected], n_times)
+    return cell, time_idx, values[selected], rate
+
+
+DEFAULT_BLOCK_DAYS = 32
+DEFAULT_SLAB_BYTES = 1024**3
+
+
+class IncrementalRateOfChange:
+    """
+    Incremental evaluation of `PP_df` over a moving date window.
+
+    The daily n-day 'adt' differences are kept per (n_days, time block). When the window moves
+    only the blocks that enter it are read and differenced (with the n_days of history before
+    them), and the every n-th day samples are gathered from the kept blocks. The blocks of every
+    n_days and window are kept least recently used first within `max_bytes`, so sessions moving
+    between a few windows reuse each other's blocks. Cells that are land on some days of the
+    window are rare and go through the `rate_of_change` kernel so the results stay identical to `PP_df`.
+
+    Parameters:
+    - source: SLRCube or SLRStore (see SLR_store.open_store) holding the whole record.
+    - block_days: Number of days per time block. Defaults to DEFAULT_BLOCK_DAYS.
+    - max_bytes: Memory budget of the kept blocks in bytes. Defaults to DEFAULT_SLAB_BYTES.
+    """
+    def __init__(self, source, block_days=DEFAULT_BLOCK_DAYS, max_bytes=DEFAULT_SLAB_BYTES):
+        self.source = source
+        self.time = np.asarray(source.time).astype('datetime64[ns]')
+        self.block_days = block_days
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.blocks_computed = 0
+        lon, lat = np.meshgrid(source.longitude, source.latitude)
+        self._lat_flat, self._lon_flat = lat.ravel(), lon.ravel()
+        self._cell_order = np.lexsort((self._lon_flat, self._lat_flat))
+        self._cell_rank = np.empty_like(self._cell_order)
+        self._cell_rank[self._cell_order] = np.arange(self._cell_order.size)
+        self._slabs = OrderedDict()
+        self._slab_bytes = {}
+        self._lock = threading.Lock()
+
+    def _read(self, start, stop):
+        if isinstance(self.source, SLRCube):
+            adt = self.source.adt[start:stop]
+        else:
+            adt = self.source.read('adt', slice(start, stop))
+        return np.ma.getdata(adt).reshape(stop - start, -1)
+
+    def _slab(self, n_days, block):
+        key = (n_days, block)
+        if key in self._slabs:
+            self._slabs.move_to_end(key)
+        else:
+            start = block * self.block_days
+            stop = min(start + self.block_days, self.time.size)
+            history = max(start - n_days, 0)
+            adt = self._read(history, stop)
+            current = adt[start - history:]
+            diff = np.full(current.shape, np.nan, dtype=current.dtype)
+            # Days of the block with n_days of history before them
+            offset = start - history
+            first = min(max(n_days - offset, 0), len(current))
+            diff[first:] = current[first:] - adt[offset + first - n_days:offset + len(current) - n_days]
+            valid = current > LAND_FILL_VALUE
+            self._slabs[key] = (current, diff, valid.all(axis=0), valid.any(axis=0))
+            self._slab_bytes[key] = current.nbytes + diff.nbytes + 2 * valid[0].nbytes
+            self.nbytes += self._slab_bytes[key]
+            self.blocks_computed += 1
+        return self._slabs[key]
+
+    @instrumented('IncrementalRateOfChange.window')
+    def window(self, start_day, end_day, n_days=1, compact=False):
+        """Return the same DataFrame (or SLRFrame) as `PP_df(source, start_day, end_day, n_days, compact)`."""
+        t_slice = time_slice(self.time, start_day, end_day)
+        start, stop = t_slice.start, t_slice.stop
+        blocks = range(start // self.block_days, (stop - 1) // self.block_days + 1) if stop > start else range(0)
+        with self._lock:
+            slabs = {block: self._slab(n_days, block) for block in blocks}
+            # Least recently used blocks go first; the ones of this window stay referenced by `slabs`
+            while self.nbytes > self.max_bytes and self._slabs:
+                key, _ = self._slabs.popitem(last=False)
+                self.nbytes -= self._slab_bytes.pop(key)
+        if not slabs:
+            empty = self._frame(*[np.array([], dtype=int)] * 2, np.array([]), np.array([]), compact)
+            return set_cadence(empty, n_days, start_day, end_day)
+
+        full = np.logical_and.reduce([slab[2] for slab in slabs.values()])
+        partial = np.logical_or.reduce([slab[3] for slab in slabs.values()]) & ~full
+
+        # Every n-th day of the cells that are sea over the whole window, gathered from the kept blocks
+        samples = np.arange(start + n_days - 1, stop, n_days)
+        sample_block = samples // self.block_days
+        full_cells = self._cell_order[full[self._cell_order]]
+        adt_rows, rate_rows = [], []
+        for block, slab in slabs.items():
+            rows = samples[sample_block == block] - block * self.block_days
+            adt_rows.append(slab[0][rows][:, full_cells])
+            rate_rows.append(slab[1][rows][:, full_cells])
+        adt_values = np.concatenate(adt_rows).T.ravel()
+        rate = np.concatenate(rate_rows)
+        rate[:1] = np.nan
+        rate = rate.T.ravel()
+        cell = np.repeat(full_cells, samples.size)
+        time_idx = np.tile(samples, full_cells.size)
+
+        if partial.any():
+            partial_cells = self._cell_order[partial[self._cell_order]]
+            window_adt = np.concatenate([slab[0][:, partial_cells] for slab in slabs.values()])
+            window_adt = window_adt[start - blocks[0] * self.block_days:stop - blocks[0] * self.block_days]
+            p_cell, p_time, p_adt, p_rate = rate_of_change(window_adt, n_days, missing=np.nan)
+            cell = np.concatenate([cell, partial_cells[p_cell]])
+            time_idx = np.concatenate([time_idx, start + p_time])
+            adt_values = np.concatenate([adt_values, p_adt])
+            rate = np.concatenate([rate, p_rate])
+            order = np.argsort(self._cell_rank[cell], kind='stable')
+            cell, time_idx, adt_values, rate = cell[order], time_idx[order], adt_values[order], rate[order]
+        return set_cadence(self._frame(cell, time_idx, adt_values, rate, compact), n_days, start_day, end_day)
+
+    def _frame(self, cell, time_idx, adt_values, rate, compact=False):
+        if compact:
+            return SLRFrame.from_cells(self.time, self.source.latitude, self.source.longitude,
+                                       cell, time_idx, adt_values, rate)
+        return _processed_frame(self.time[time_idx], self._lat_flat[cell], self._lon_flat[cell], adt_values, rate)
+
+
 def get_state_data(year):
     
     state_dic = {"2021": {"AL": 0.5429423272272488, "GA": 0.6464300955040011, "FL": 1.4747096486917715, "TN": 1.1372408123014286, "TX": 0.7438972239014163, "MS": -0.1275535281693059, "NC": 0.9502403547211243, "CA": -1.031155851087727, "VA": -0.1434072014560221, "CO": 0.00909401623406284, "SC": 1.576771789789334, "LA": -0.8366090025428874, "OH": -0.10311575343652278, "IL": -1.0200873483363122, "NY": -1.6504318162273244, "MI": -0.09092400963065513, "KY": 0.1604838917813008, "IN": 0.17034136560067467, "WA": -0.12603563816972338, "MO": 0.1916789372309149, "AZ": 1.0607806534836997, "PA": -0.1472046220534838, "MD": -0.5070220723635699, "AR": 0.6606153435700027, "OK": 0.6825491919492434, "KS": -0.20894490777392302, "NV": 0.7899887616117663, "MA": -0.8088850219906317, "WI": -0.020883934770444465, "UT": 0.5012592405869196, "IA": -0.044364342864929775, "NJ": -0.3385846919956289, "MN": -0.34937678268808375, "OR": -0.2024680462740632, "NM": -0.1679265601177085, "HI": -0.8820134713776292, "AK": -0.7110122918708773, "WV": 0.1375928764280454, "CT": 0.0011011508149639654, "ID": 2.038918185187335, "NE": -0.2522221797879351, "ME": 1.189144711044833, "MT": 1.6491070761413735, "SD": 0.8194497539800965, "ND": -0.9826061473219673, "WY": 0.4310578392379136, "NH": 0.8526251419585918, "DE": 1.3548346823695874, "VT": 0.5556444510674994, "RI": -0.09318728997277793}, "2020": {"AL": 0.4270483282334644, "GA": 0.43458160563391257, "FL": 0.939400759028851, "TN": 0.8090964169266702, "TX": 0.5578153921246386, "MS": -0.1995729364398429, "NC": 0.8331212428113453, "CA": -0.7894147144539396, "VA": -0.1531994039068931, "CO": 0.2967989888119561, "LA": -0.596852245222073, "SC": 1.3024260192852337, "OH": -0.10698426693171972, "NY": -1.4969072776040664, "MI": -0.11146733553535487, "KY": 0.13561288009127206, "IL": -0.9366279394197677, "IN": 0.11511595867472013, "WA": 0.20261150516007218, "AZ": 1.4400136655203024, "PA": -0.04899502531502155, "MO": 0.15860364396634682, "MD": -0.40507749401102033, "AR": 0.38930135887158074, "OK": 0.46099902460884323, "KS": -0.2909982918367707, "NJ": -0.30711434272972293, "NV": 1.1417796732193375, "OR": 0.4053811465923567, "WI": 0.00023797505439713117, "MA": -0.6539517323245514, "HI": -0.7075116824798551, "UT": 0.5818193926250157, "AK": -1.0829281921141916, "MN": -0.2366663156718471, "NM": 0.13321895789057778, "IA": -0.1439629238797597, "WV": -0.042223779274349366, "CT": -0.1244141356510051, "NE": -0.25735292665382337, "ID": 2.290255690484209, "MT": 1.2963339106799272, "ME": 1.0378913076232248, "WY": 0.23556816704593053, "ND": -0.8136737483309764, "NH": 0.8296114588775306, "DE": 1.2398147845152, "SD": 0.3018172575930868, "RI": 0.02795511626320072, "VT": 0.5472511376052059}, "2019": {"AL": 0.2020393943996795, "GA": 0.41630606961859, "FL": 0.7103749980865373, "TN": 0.6387206808903165, "TX": 0.4704904301547558, "MS": -0.3746577904106515, "NC": 0.5790625656510708, "CA": -0.5074450554033463, "VA": -0.12678910805105145, "LA": -0.5525227130075954, "SC": 1.0292847554568372, "CO": 0.4726404733672025, "OH": -0.14883515528293179, "NY": -0.9158989954344948, "MI": -0.20875004098763814, "IL": -0.7764613373774687, "WA": 0.5023734106357078, "KY": -0.05830441698413327, "AZ": 1.2487318403788423, "IN": 0.03230316227648315, "MO": -0.018953403942717086, "PA": -0.14240841724804382, "MD": -0.3697434954298988, "AR": 0.07141912366466094, "OK": 0.1109941074785353, "KS": -0.4655502233623778, "MA": -0.47460610120199054, "NV": 1.3147323274690739, "WI": -0.05606494095149793, "NJ": -0.38053727457883046, "OR": 0.5044483568794641, "HI": -0.7455745345009247, "MN": -0.10753234833006083, "UT": 0.24818334264952485, "NM": 0.0016015960109582018, "AK": -1.1965931060909551, "IA": -0.2401322212649435, "NE": -0.3193314312381229, "CT": -0.4559966730989687, "WV": -0.3969784016257396, "MT": 0.6124919174013506, "ID": 1.5371413422138296, "ND": -0.4445838046070977, "ME": 0.4795740211945807, "WY": 0.06430763690418974, "DE": 0.7979839352136481, "SD": 0.03350763805723069, "NH": 0.38954835466123117, "RI": -0.24258268211876313, "VT": -0.2645010319502359}, "2018": {"AL": 0.18560358000436586, "GA": 0.4304439900656, "FL": 0.6543868943807084, "TN": 0.6081034536000437, "TX": 0.3276559624485808, "MS": -0.31130877502538506, "NC": 0.6963782166271955, "CA": -0.4517536496619888, "VA": -0.14567544970649493, "LA": -0.5706329893212819, "SC": 1.0923979670371957, "CO": 0.6374745379934796, "NY": -0.9563785873940331, "OH": -0.10484992615754282, "IL": -0.8084684891790033, "KY": -0.01138172368493749, "MI": -0.12870114417363698, "WA": 0.5267251729877983, "IN": 0.0747443248860824, "AZ": 1.2404811576923553, "MO": -0.0415152960179855, "MD": -0.3486280949029927, "PA": -0.13261613983594117, "AR": 0.09552777526126623, "OK": -0.024116346355326154, "KS": -0.44564943218704817, "NJ": -0.4578461158025077, "WI": -0.01790350613681229, "MA": -0.49323309312078745, "NV": 1.544086243807959, "OR": 0.6152410709889848, "HI": -0.7775028450889367, "MN": 0.05792587177052883, "AK": -1.4281881343866505, "UT": 0.2987761244679203, "IA": -0.13288404900849132, "NM": -0.1401225702881835, "CT": -0.5465263469125651, "WV": -0.3405291306266056, "NE": -0.24609859078145355, "ID": 1.5187025494300956, "MT": 0.40250132381614107, "ND": -0.5982779476238842, "ME": 0.5459889786748177, "DE": 0.8774864433274205, "WY": -0.35781168203871705, "NH": 0.35493610310389945, "SD": 0.06257185498325465, "RI": -0.24139064928853285, "VT": -0.14632162359243653}, "2017": {"AL": 0.30194299714451855, "GA": 0.6009308745307276, "FL": 1.1467664396140043, "TN": 0.847118690699349, "TX": 0.417479155544067, "MS": -0.31271542398369684, "NC": 0.9658627300005652, "CA": -0.5016189348635434, "VA": -0.22101594254885087, "LA": -0.7852292380729394, "SC": 1.6468783785093237, "CO": 0.8325939247580105, "OH": -0.14897107826662032, "KY": -0.009164689864376154, "IL": -1.2007719049753367, "MI": -0.06861291886762493, "NY": -1.3424225982503093, "WA": 1.0198001294683485, "IN": 0.009817705092762858, "AZ": 1.4482487060995242, "MO": -0.019970633658696165, "PA": -0.2145532709986576, "MD": -0.49141616958135587, "AR": 0.21313968618809717, "OK": -0.3001303492364779, "KS": -0.6997022353599504, "MA": -0.6448483165657165, "HI": -1.371648371447411, "NJ": -0.6145524596947433, "NV": 1.795360207685733, "WI": -0.01859738321992314, "OR": 1.1275247440815548, "MN": 0.17670771209781203, "AK": -2.2185875027537505, "UT": 0.4481302631868983, "IA": -0.21492027444015047, "NM": -0.3947709060648625, "CT": -0.700088127252262, "NE": -0.35691168699799186, "WV": -0.6278706414198547, "ID": 2.191086650434608, "MT": 1.0341993989229104, "ME": 0.8994228120635198, "ND": -1.6330324082551326, "SD": 0.09952188546793535, "NH": 0.6645246666442373, "DE": 0.9389703053172315, "WY": -1.8201606244839752, "RI": -0.352976154549458, "VT": -0.044928514670474436}, "2016": {"AL": 0.019723610079899534, "GA": 0.4708626856941329, "FL": 1.1964048701303158, "TN": 0.5067644663429892, "TX": 0.230183742236911, "MS": -0.26751101537456956, "NC": 0.632515406067848, "CA": -0.22756306651620178, "LA": -0.30569276406446927, "VA": -0.2949949606183785, "CO": 0.858704970665617, "SC": 1.0393003300984207, "OH": -0.21955023382617248, "NY": -0.9184526574592881, "KY": -0.10137848200746565, "IL": -0.7597273338271515, "MI": -0.1678796402373763, "WA": 0.9397439782187772, "IN": -0.10543645186454956, "MO": -0.08661192978995615, "AZ": 0.9020192436604797, "PA": -0.3094987158488475, "MD": -0.42884190265405503, "AR": 0.037035636678022475, "KS": -0.6195215561549765, "OK": -0.12766343978098907, "NJ": -0.5986780032086557, "WI": -0.1526128280428361, "MA": -0.46858133265856117, "HI": -0.6471165104906343, "NV": 1.146726674565696, "OR": 1.206272868187425, "IA": -0.15977034255689126, "AK": -0.8703936303834118, "NM": -0.4520992409799381, "MN": -0.020942231767257312, "UT": 0.39274384948954205, "WV": -0.45402185876416035, "CT": -0.6677783452705112, "NE": -0.1218242420383997, "MT": 0.5719504627045677, "ND": -1.235517994067275, "ID": 1.0993572675822612, "ME": 0.26651413882695685, "WY": -0.7612260227543374, "RI": -0.3916972893094045, "SD": 0.0951137466111761, "NH": 0.27303159593373677, "DE": 0.4550146223980733, "VT": -0.33037281310579414}, "2015": {"AL": -0.09279261826581993, "GA": 0.2283034971421792, "FL": 0.7383895020917834, "TX": 0.2536452925928567, "TN": 0.2724446073861618, "MS": -0.2773416243799574, "CA": -0.10704438671464186, "NC": 0.23854441764124046, "LA": -0.11805127068261667, "VA": -0.15001916971443585, "SC": 0.5291061286766302, "CO": 0.6794900537811523, "NY": -0.5002084822923755, "OH": -0.16241077199413873, "IL": -0.44555598377823014, "MI": -0.2086965127198413, "KY": -0.12059204171330144, "WA": 0.502415375151913, "IN": -0.10352744065053394, "MO": -0.14038620297456347, "MD": -0.314915285626643, "PA": -0.1687695210311861, "AZ": 0.36938232684367145, "OK": 0.0353397521335035, "AR": -0.06935022764444591, "KS": -0.28232713631183287, "NJ": -0.44523537808046065, "MA": -0.20158761962282865, "HI": -0.11401924595347047, "NV": 0.8562731554368539, "WI": -0.16264492878364809, "MN": -0.10018503065807756, "OR": 0.521344934871826, "IA": -0.08377478854622818, "AK": -0.5044503586147747, "NM": -0.4220912647532629, "UT": 0.0487287311816046, "NE": -0.10271168052143353, "CT": -0.4332115585435266, "WV": -0.2516878707368546, "ND": 0.8496461553773381, "WY": -0.0017390048076794452, "ME": -0.11291139995230147, "MT": 0.2248308810054399, "ID": 0.1915995038570606, "NH": 0.01916304392505455, "RI": -0.3547365976609604, "DE": 0.28514672717948, "SD": 0.014303933674043805, "VT": -0.19597142594352637}, "2014": {"AL": -0.1303831167233728, "GA": 0.1529433652256963, "FL": 0.7387399120368703, "TX": 1.0542414344679718, "TN": 0.31211606579402074, "MS": -0.3726188518397022, "CA": -0.13806605529476268, "NC": 0.2623781026547087, "LA": -0.21631864451579766, "VA": -0.4408355513176743, "SC": 0.7643536305906764, "OH": -0.2017037272781266, "NY": -0.713721301205721, "CO": 0.7073674767023186, "KY": -0.2256391391453672, "MI": -0.29951088389589453, "IL": -0.7091461250571467, "IN": -0.11854849000786523, "MO": -0.16860482291409756, "WA": 0.48296981373150094, "PA": -0.2593219821664953, "MD": -0.07163040468981398, "AZ": 0.4262223146182165, "AR": -0.1853253217909399, "OK": 0.08404752246354888, "KS": -0.4651473112319773, "HI": -0.3882403027805661, "WI": -0.2142046858859392, "NV": 0.7136187923844522, "NJ": -0.5703371593199262, "MA": -0.3150796244711442, "OR": 0.6538155574726303, "AK": -1.23261002944592, "MN": -0.17686504634172748, "NM": -0.5746246497977058, "IA": -0.1267056730449217, "UT": -0.09557138533078179, "CT": -0.5522591608122299, "NE": -0.18182295317965233, "WV": -0.27882449732040315, "ND": 0.8595186273059611, "MT": 0.3058519729888386, "ID": 0.42523848413325754, "NH": 0.08135327918935062, "WY": -0.3307367085103661, "DE": 0.2704688620870294, "ME": 0.14230403163954575, "SD": -0.053151713317986536, "RI": -0.41800620972296204, "VT": -0.24014253621504378}, "2013": {"AL": -0.029650578002406495, "GA": -0.11704720568940546, "FL": -0.4988904154768396, "TX": -0.8096258787240642, "TN": -0.3003299889113038, "MS": 0.3253531402559261, "NC": -0.41358686436606057, "CA": 0.1534533790444692, "LA": 0.10278291749985481, "VA": 0.049151379712247256, "SC": -0.857841228084879, "OH": 0.19052148835110277, "NY": 0.767801568539574, "CO": -0.7824391667882983, "MI": 0.22928182051907237, "IL": 0.6770692905416755, "KY": 0.11035525772817528, "MO": 0.07145703063667246, "IN": 0.027508361093964085, "WA": -0.3660235817355904, "PA": 0.2577444814844692, "MD": 0.23986076418450078, "AZ": -0.3753289191640762, "OK": -0.31706877662320493, "AR": 0.08739126503653391, "KS": 0.4202297995396012, "NJ": 0.553265102239856, "WI": 0.17996148508166696, "HI": 0.03394159923581488, "NV": -0.6408644140185326, "MA": 0.26456047595848403, "MN": 0.12759828158026093, "AK": 1.3911330540594453, "IA": 0.019708405061677522, "NM": 0.5773306625784721, "OR": -0.4055276685164708, "UT": 0.06717485636771844, "CT": 0.6080011827839541, "WV": 0.17080199835784984, "NE": 0.11350831575782751, "MT": -0.588563079447679, "WY": 0.013667234382556404, "ID": -0.5307874898449165, "ND": -1.6447242939535522, "NH": -0.21248229837741933, "SD": -0.29861173012381864, "ME": -0.10779660025083823, "DE": -0.6242594419954967, "RI": 0.3924295158953521, "VT": 0.22014098024290962}, "2012": {"AL": 0.11171711284122292, "GA": -0.0128539298400677, "FL": -0.2197239199954586, "TN": -0.42159670955227385, "TX": -0.6473542561626231, "MS": 0.23365970505823228, "CA": 0.07397738977410624, "NC": -0.40138460704928985, "LA": 0.005143364013084884, "VA": -0.0693718736579185, "SC": -0.619056697266642, "IL": 0.5288109948304123, "MI": 0.27325006552146086, "OH": 0.2874738624408944, "NY": 0.7000306667280539, "KY": 0.06003286480024064, "CO": -0.6038666492658099, "WA": -0.22314633554206018, "IN": 0.14024410203744392, "MO": 0.1955691611831806, "PA": 0.18757330519978216, "AZ": -0.40927892539226096, "MD": 0.1098116266078713, "AR": 0.07711809047831361, "OK": -0.22823940721448843, "KS": 0.31860935883752384, "NV": -0.6402652715784629, "MA": 0.26923603443287586, "WI": 0.1657812844533674, "NJ": 0.5491386875671422, "MN": 0.16793017726033013, "OR": -0.23446427821530316, "HI": -0.04777237778546817, "IA": 0.10160182323800424, "AK": 0.6289042767228464, "NM": 0.5276527830115488, "UT": 0.16977284405907025, "NE": 0.08810564558835197, "WV": 0.0509377689053672, "CT": 0.5048532877045562, "WY": -0.8713382722762184, "ID": -0.026970023360715797, "SD": -0.5868926948985481, "NH": 0.023302775919627407, "MT": -0.3575595221872409, "ND": -1.8025910520595125, "ME": -0.0154374052968189, "DE": -0.21401844703401565, "RI": 0.5631527263558793, "VT": 0.3034530499871855}}
@@ -116,8 +572,145 @@ def get_state_data(year):
     else:
         print(f"state data for year {year} is not available. Available years only are: \n {list(state_dic.keys())}") 
         return {}
-    
 
 
+class SLRCache:
+    """
+    Size-bounded LRU cache for loaded cubes and processed results.
+
+    Entries are evicted least recently used first once their total memory footprint exceeds
+    `max_bytes`. When `disk_dir` is given, entries are also pickled there so that several
+    dashboard workers on the same host share them; files are written atomically and the oldest
+    ones are removed once the directory exceeds `max_disk_bytes`. Entries put with disk=False
+    (e.g. large cubes, slower to pickle than to reload) stay in memory only.
+
+    Parameters:
+    - max_bytes: Memory budget of the in-process tier in bytes.
+    - disk_dir: Directory of the shared on-disk tier (None to disable it).
+    - max_disk_bytes: Size budget of the on-disk tier in bytes.
+    """
+    def __init__(self, max_bytes=2 * 1024**3, disk_dir=None, max_disk_bytes=10 * 1024**3):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key, default=None, disk=True):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+        value = self._disk_get(key) if disk else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return default
+            self.disk_hits += 1
+        self._memory_put(key, value)
+        return value
+
+    def put(self, key, value, disk=True):
+        self._memory_put(key, value)
+        if disk:
+            self._disk_put(key, value)
+
+    def get_or_compute(self, key, compute, disk=True):
+        """Return the cached value of `key`, computing and storing it with `compute()` on a miss."""
+        value = self.get(key, disk=disk)
+        if value is None:
+            value = compute()
+            self.put(key, value, disk=disk)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'entries': len(self._entries), 'nbytes': self.nbytes}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _memory_put(self, key, value):
+        size = _footprint(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_size
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha1(repr(key).encode()).hexdigest() + '.pkl')
+
+    def _disk_get(self, key):
+        if self.disk_dir is None:
+            return None
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                stored_key, value = pk.load(f)
+        except (OSError, EOFError, pk.UnpicklingError):
+            return None
+        return value if stored_key == key else None
+
+    def _disk_put(self, key, value):
+        if self.disk_dir is None:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pk.dump((key, value), f, protocol=pk.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._disk_path(key))
+        self._disk_prune()
+
+    def _disk_prune(self):
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith('.pkl'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+def _footprint(value):
+    """Approximate memory footprint of a cached value in bytes."""
+    if isinstance(value, SLRCube):
+        adt = value.adt
+        mask_bytes = np.ma.getmaskarray(adt).nbytes if np.ma.isMaskedArray(adt) else 0
+        return value.time.nbytes + value.latitude.nbytes + value.longitude.nbytes + np.ma.getdata(adt).nbytes + mask_bytes
+    if isinstance(value, SLRFrame):
+        return value.nbytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True).sum())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(_footprint(item) for item in value)
+    if isinstance(value, dict):
+        return sum(_footprint(item) for item in value.values())
+    return sys.getsizeof(value)
 
 
+# Shared cache of load_initial_data. Set SLR_CACHE_DIR to share it between the workers of a host.
+SLR_CACHE = SLRCache(max_bytes=int(os.environ.get('SLR_CACHE_BYTES', 2 * 1024**3)),
+                     disk_dir=os.environ.get('SLR_CACHE_DIR'))
@@ -0,0 +1,213 @@
+import cProfile
+import contextlib
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import uuid
+
+# SLR_INSTRUMENT=1 records every traced request, SLR_INSTRUMENT_MEMORY=0 leaves out the (slower) peak memory
+ENABLED = os.environ.get('SLR_INSTRUMENT', '0') not in ('', '0')
+TRACK_MEMORY = os.environ.get('SLR_INSTRUMENT_MEMORY', '1') not in ('', '0')
+PROFILE_LINES = 30
+
+logger = logging.getLogger('SLR.instrument')
+if os.environ.get('SLR_INSTRUMENT_LOG'):
+    # One JSON report per line
+    _handler = logging.FileHandler(os.environ['SLR_INSTRUMENT_LOG'])
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+
+class _Local(threading.local):
+    # A class default keeps the disabled path to a plain attribute read
+    trace = None
+
+
+_local = _Local()
+# tracemalloc is process wide, so only one request at a time records peak memory
+_memory_lock = threading.Lock()
+
+
+class Stage:
+    """Wall time, row count and peak traced memory of one pipeline stage."""
+    __slots__ = ('name', 'depth', 'seconds', 'rows', 'peak_bytes', '_start', '_child_peak')
+
+    def __init__(self, name, depth=0):
+        self.name = name
+        self.depth = depth
+        self.seconds = None
+        self.rows = None
+        self.peak_bytes = None
+        self._start = None
+        self._child_peak = 0
+
+    def to_dict(self):
+        return {'stage': self.name, 'depth': self.depth, 'seconds': self.seconds, 'rows': self.rows,
+                'peak_mb': None if self.peak_bytes is None else self.peak_bytes / 1e6}
+
+
+# Returned by `stage` outside of a trace; setting its rows is harmless
+_NULL_STAGE = Stage(None)
+
+
+class Trace:
+    """
+    The stages recorded while serving one request, in the order they started.
+
+    Parameters:
+    - name: Name of the request, e.g. 'update_figure'.
+    - profile: Also capture a cProfile of the request. Defaults to False.
+    - track_memory: Record the peak traced memory of the stages. Defaults to False.
+    """
+    def __init__(self, name, profile=False, track_memory=False):
+        self.name = name
+        self.id = uuid.uuid4().hex[:12]
+        self.started = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.seconds = None
+        self.stages = []
+        self.profile = profile
+        self.profile_text = None
+        self.track_memory = track_memory
+        self._stack = []
+
+    def to_dict(self):
+        return {'request': self.name, 'id': self.id, 'started': self.started, 'seconds': self.seconds,
+                'stages': [stage.to_dict() for stage in self.stages], 'profile': self.profile_text}
+
+
+def current_trace():
+    """Return the Trace of the request served by this thread, or None."""
+    return _local.trace
+
+
+@contextlib.contextmanager
+def trace(name, profile=False):
+    """
+    Record the stages run by this thread inside the block as one request.
+
+    Nothing is recorded (and None is yielded) unless instrumentation is enabled or `profile` is
+    True. The report is logged as one JSON line on the 'SLR.instrument' logger.
+
+    Peak memory comes from tracemalloc, whose peak is shared by the whole process, so it is only
+    recorded by one request at a time: a request traced while another thread's request holds
+    tracemalloc reports its timings with a peak_mb of None. The holder's peaks still include what
+    other threads allocate meanwhile, so they are exact only for single threaded runs.
+
+    Parameters:
+    - name: Name of the request.
+    - profile: Capture a cProfile of the request, even when instrumentation is disabled. Defaults to False.
+
+    Yields:
+    - The Trace, whose `to_dict()` is the report.
+    """
+    if not (ENABLED or profile) or current_trace() is not None:
+        yield current_trace()
+        return
+    track_memory = TRACK_MEMORY and _memory_lock.acquire(blocking=False)
+    request = Trace(name, profile, track_memory)
+    started_tracing = track_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    profiler = cProfile.Profile() if profile else None
+    _local.trace = request
+    tic = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield request
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(PROFILE_LINES)
+            request.profile_text = text.getvalue()
+        request.seconds = time.perf_counter() - tic
+        _local.trace = None
+        if started_tracing:
+            tracemalloc.stop()
+        if track_memory:
+            _memory_lock.release()
+        logger.info(json.dumps(request.to_dict()))
+
+
+@contextlib.contextmanager
+def stage(name, rows=None):
+    """
+    Time a pipeline stage of the current request; a no-op outside of `trace`.
+
+    Set the `rows` of the yielded Stage inside the block to record the size of its output.
+    """
+    request = current_trace()
+    if request is None:
+        yield _NULL_STAGE
+        return
+    record = Stage(name, depth=len(request._stack))
+    record.rows = rows
+    request.stages.append(record)
+    request._stack.append(record)
+    tracing = request.track_memory
+    if tracing:
+        tracemalloc.reset_peak()
+    record._start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record.seconds = time.perf_counter() - record._start
+        request._stack.pop()
+        if tracing:
+            # reset_peak is shared by nested stages, so a parent keeps the peaks of its children
+            record.peak_bytes = max(tracemalloc.get_traced_memory()[1], record._child_peak)
+            if request._stack:
+                parent = request._stack[-1]
+                parent._child_peak = max(parent._child_peak, record.peak_bytes)
+            tracemalloc.reset_peak()
+
+
+def instrumented(name=None, rows=len):
+    """
+    Decorator recording every call of a function as a stage of the current request.
+
+    Parameters:
+    - name: Stage name. Defaults to the function name.
+    - rows: Function of the result giving the row count (None to skip it). Defaults to len.
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _local.trace is None:
+                return func(*args, **kwargs)
+            with stage(stage_name) as record:
+                result = func(*args, **kwargs)
+                if rows is not None:
+                    try:
+                        record.rows = int(rows(result))
+                    except (TypeError, ValueError, IndexError, KeyError):
+                        pass
+            return result
+        return wrapper
+    return decorator
+
+
+def format_report(report):
+    """Render a report (Trace.to_dict()) as a fixed width table for the apps' debug panels."""
+    if not report:
+        return ''
+    lines = [f"{report['request']} {report['id']}: {report['seconds'] * 1e3:.1f} ms",
+             f"{'stage':<32} {'ms':>10} {'rows':>12} {'peak MB':>10}"]
+    for record in report['stages']:
+        rows = '' if record['rows'] is None else f"{record['rows']:,}"
+        peak = '' if record['peak_mb'] is None else f"{record['peak_mb']:.1f}"
+        label = '  ' * record['depth'] + record['stage']
+        lines.append(f"{label:<32} {record['seconds'] * 1e3:>10.1f} {rows:>12} {peak:>10}")
+    if report.get('profile'):
+        lines += ['', report['profile']]
+    return '\n'.join(lines)
@@ -0,0 +1,153 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from SLR_instrument import stage, trace
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+DEFAULT_SESSION_TTL = 600
+
+
+def build_figure_job(start_day, end_day, n_days, profile=False, size_scaling_factor=10, point_budget=None):
+    """
+    Worker side of a dashboard request: load the window, aggregate it per state and build the figure.
+
+    The window is read from the pyramid level fitting `point_budget` (defaults to the map's
+    SLR_visualization.DEFAULT_POINT_BUDGET), so the work does not grow with the grid resolution.
+
+    May run in a worker process, so it returns the figure as a plain dictionary, together with the
+    instrumentation report of the request (see SLR_instrument.trace), None when it is disabled.
+    """
+    from SLR_PP import load_window_data
+    from SLR_spatial import load_state_index
+    from SLR_visualization import DEFAULT_POINT_BUDGET, migrationSLRMap
+    point_budget = point_budget or DEFAULT_POINT_BUDGET
+    with trace('build_figure_job', profile=profile) as request:
+        state_data, SLR_data_pp = load_window_data(start_day, end_day, n_days, point_budget=point_budget)
+        state_table = load_state_index(point_budget=point_budget).aggregate(SLR_data_pp)
+        fig = migrationSLRMap(state_data, SLR_data_pp, size_scaling_factor=size_scaling_factor,
+                              point_budget=point_budget, state_table=state_table)
+        with stage('figure_to_dict'):
+            figure = fig.to_dict()
+    return figure, None if request is None else request.to_dict()
+
+
+class FigureJobs:
+    """
+    Background figure generation on a worker pool with request coalescing.
+
+    Every session (e.g. a browser tab) has at most one wanted job. Sessions submitting the same
+    key share one job, a new submission supersedes the session's previous one, and a job nobody
+    wants any more is cancelled if it has not started yet (a running one finishes in the
+    background and its result is discarded). Finished results are kept for the `max_results`
+    most recent keys, and for as long as a session waits for them. A session is forgotten once its result is delivered, or after
+    `session_ttl` seconds without a submit or poll (e.g. a closed tab).
+
+    Jobs run on threads by default: the kernels release the GIL in NumPy, and threads share the
+    SLR_PP caches and incremental blocks, which every worker process would otherwise hold and
+    rebuild separately.
+
+    Parameters:
+    - build: Function called as build(*key) in a worker (picklable with processes). Defaults to build_figure_job.
+    - max_workers: Number of worker threads or processes. Defaults to the executor's default.
+    - max_results: Number of finished results kept. Defaults to 32.
+    - executor: Executor to use instead of a new pool.
+    - use_processes: Run the jobs on a process pool instead of threads. Defaults to False.
+    - session_ttl: Seconds after which an idle session is forgotten. Defaults to DEFAULT_SESSION_TTL.
+    """
+    def __init__(self, build=build_figure_job, max_workers=None, max_results=32, executor=None,
+                 use_processes=False, session_ttl=DEFAULT_SESSION_TTL):
+        self.build = build
+        self.max_results = max_results
+        self.session_ttl = session_ttl
+        pool = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self._executor = executor or pool(max_workers=max_workers)
+        self._jobs = OrderedDict()
+        self._subscribers = {}
+        self._wanted = {}
+        self._last_seen = {}
+        self._lock = threading.Lock()
+
+    def submit(self, session_id, key):
+        """Ask for the result of `key` on behalf of `session_id`, reusing an identical job if there is one."""
+        key = tuple(key)
+        with self._lock:
+            self._expire()
+            self._last_seen[session_id] = time.monotonic()
+            previous = self._wanted.get(session_id)
+            if previous is not None and previous != key:
+                self._unsubscribe(session_id, previous)
+            self._wanted[session_id] = key
+            self._subscribers.setdefault(key, set()).add(session_id)
+            future = self._jobs.get(key)
+            if future is None or future.cancelled():
+                self._jobs[key] = self._executor.submit(self.build, *key)
+            self._jobs.move_to_end(key)
+            self._prune()
+        return key
+
+    def poll(self, session_id, key):
+        """
+        Return (status, result) of the job `key` for `session_id`.
+
+        The status is PENDING, DONE (result is the build output), FAILED (result is the exception),
+        or CANCELLED when the session has since asked for another key or the job is gone. A DONE
+        or FAILED result is delivered once, after which the session is forgotten.
+        """
+        key = tuple(key)
+        with self._lock:
+            future = self._jobs.get(key)
+            if self._wanted.get(session_id) != key or future is None or future.cancelled():
+                return CANCELLED, None
+            self._last_seen[session_id] = time.monotonic()
+        if not future.done():
+            return PENDING, None
+        error = future.exception()
+        with self._lock:
+            # The session may have asked for another key while the lock was released
+            if self._wanted.get(session_id) != key:
+                return CANCELLED, None
+            self._forget(session_id)
+            if error is not None and self._jobs.get(key) is future:
+                del self._jobs[key]
+        if error is not None:
+            return FAILED, error
+        return DONE, future.result()
+
+    def cancel(self, session_id):
+        """Drop the job wanted by `session_id`, cancelling it if no other session wants it."""
+        with self._lock:
+            self._forget(session_id)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _forget(self, session_id):
+        self._last_seen.pop(session_id, None)
+        key = self._wanted.pop(session_id, None)
+        if key is not None:
+            self._unsubscribe(session_id, key)
+
+    def _expire(self):
+        deadline = time.monotonic() - self.session_ttl
+        for session_id in [s for s, seen in self._last_seen.items() if seen < deadline]:
+            self._forget(session_id)
+
+    def _unsubscribe(self, session_id, key):
+        subscribers = self._subscribers.get(key, set())
+        subscribers.discard(session_id)
+        if not subscribers:
+            self._subscribers.pop(key, None)
+            future = self._jobs.get(key)
+            if future is not None and not future.done() and future.cancel():
+                del self._jobs[key]
+
+    def _prune(self):
+        # Results a session has not polled yet are kept, idle sessions are expired by the TTL
+        wanted = set(self._wanted.values())
+        finished = [key for key, future in self._jobs.items() if future.done() and key not in wanted]
+        for key in finished[:max(len(finished) - self.max_results, 0)]:
+            del self._jobs[key]
@@ -0,0 +1,195 @@
+import functools
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError, EndpointConnectionError
+from SLR_store import INDEX_FILE, LEVELS_DIR, PYRAMID_FACTORS, chunk_file_name, choose_pyramid_level, open_store, \
+    time_slice
+
+DEFAULT_BUCKET = 'competitions23'
+DEFAULT_MAX_WORKERS = 16
+DEFAULT_PART_BYTES = 8 * 1024**2
+S3_CACHE_DIR = os.environ.get('SLR_S3_CACHE_DIR', os.path.join(
+    os.environ.get('SLR_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'slr')), 's3'))
+# Keys of the legacy pickles and prefixes of the chunked stores (see SLR_store.write_store) in the bucket
+S3_PICKLE_KEYS = {'east_coast': 'slr/slr_eastcost_21_23.pkl',
+                  'all_us': 'slr/slr_all_us_11_21.pkl'}
+S3_STORE_PREFIXES = {'east_coast': 'slr/slr_eastcost_21_23',
+                     'all_us': 'slr/slr_all_us_11_21'}
+_AXES_FILES = ('time.npy', 'latitude.npy', 'longitude.npy')
+
+
+class S3Loader:
+    """
+    Parallel byte-range reads of S3 objects into a local disk cache.
+
+    Objects are split into `part_bytes` ranges fetched concurrently on a thread pool with one
+    shared client, and written straight into their file, so memory stays at a few parts whatever
+    the object size. Files are mirrored under '<cache_dir>/<bucket>/<key>' and moved in place once
+    complete, so an object is downloaded once per host and a cached file is always whole. The ETag
+    of each file is kept beside it in '<file>.etag', so `open_store` can tell a stale store copy.
+
+    Parameters:
+    - bucket: Name of the bucket. Defaults to DEFAULT_BUCKET.
+    - cache_dir: Root of the local cache. Defaults to S3_CACHE_DIR.
+    - max_workers: Number of concurrent range requests (and pooled connections). Defaults to DEFAULT_MAX_WORKERS.
+    - part_bytes: Size of the byte ranges. Defaults to DEFAULT_PART_BYTES.
+    - endpoint_url: S3 compatible endpoint, e.g. a local MinIO or moto server. Defaults to AWS.
+    - client: Client to use instead of a new boto3 one.
+    """
+    def __init__(self, bucket=DEFAULT_BUCKET, cache_dir=S3_CACHE_DIR, max_workers=DEFAULT_MAX_WORKERS,
+                 part_bytes=DEFAULT_PART_BYTES, endpoint_url=None, client=None):
+        self.bucket = bucket
+        self.cache_dir = cache_dir
+        self.part_bytes = part_bytes
+        self.client = client or boto3.client('s3', endpoint_url=endpoint_url,
+                                             config=Config(max_pool_connections=max_workers))
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self.bytes_downloaded = 0
+
+    def local_path(self, key):
+        return os.path.join(self.cache_dir, self.bucket, *key.split('/'))
+
+    def fetch(self, key):
+        """Return the local path of object `key`, downloading it first if it is not cached."""
+        return self.fetch_many([key])[0]
+
+    def fetch_many(self, keys):
+        """
+        Return the local paths of the objects `keys`, downloading the missing ones with parallel range requests.
+
+        The ranges of all missing objects share the thread pool, so many small chunks download as
+        concurrently as the parts of one large file.
+        """
+        paths = [self.local_path(key) for key in keys]
+        missing = [(key, path) for key, path in zip(keys, paths) if not os.path.isfile(path)]
+        if not missing:
+            return paths
+        heads = list(self._executor.map(
+            lambda key: self.client.head_object(Bucket=self.bucket, Key=key), [key for key, _ in missing]))
+
+        downloads, ranges = [], []
+        for (key, path), head in zip(missing, heads):
+            size = head['ContentLength']
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.truncate(size)
+            downloads.append((tmp_path, path, head['ETag']))
+            ranges += [(key, tmp_path, start, min(start + self.part_bytes, size))
+                       for start in range(0, size, self.part_bytes)]
+        try:
+            for future in [self._executor.submit(self._fetch_range, *args) for args in ranges]:
+                future.result()
+        except BaseException:
+            for tmp_path, _, _ in downloads:
+                os.remove(tmp_path)
+            raise
+        for tmp_path, path, etag in downloads:
+            os.replace(tmp_path, path)
+            with open(f'{path}.etag', 'w') as f:
+                f.write(etag)
+        return paths
+
+    def _fetch_range(self, key, tmp_path, start, stop):
+        response = self.client.get_object(Bucket=self.bucket, Key=key, Range=f'bytes={start}-{stop - 1}')
+        body = response['Body'].read()
+        with open(tmp_path, 'r+b') as f:
+            f.seek(start)
+            f.write(body)
+        with self._lock:
+            self.bytes_downloaded += len(body)
+
+    def open_store(self, prefix, start_day=None, end_day=None, variables=('adt',), point_budget=None,
+                   lat_range=None, lon_range=None):
+        """
+        Mirror the parts of the store under `prefix` needed for a window and open the local copy.
+
+        The index and coordinate axes are fetched first, then only the chunks of `variables`
+        overlapping [start_day, end_day]. Reading the returned store outside that window needs
+        another call with the wider window. A local copy whose index no longer matches the
+        bucket's (by ETag) is dropped with all its chunks and mirrored again.
+
+        Parameters:
+        - prefix: Key prefix of the store in the bucket (see S3_STORE_PREFIXES).
+        - start_day, end_day: Inclusive window bounds in YYYY-MM-DD format (None for open ended).
+        - variables: Variables whose chunks are fetched. Defaults to ('adt',).
+        - point_budget: When given, the finest pyramid level with at most `point_budget` cells in the
+          bounding box is mirrored instead of the full resolution store (see SLR_store.choose_pyramid_level).
+        - lat_range, lon_range: Bounding box used with `point_budget`.
+
+        Returns:
+        - An SLRStore reading the local copy.
+        """
+        prefix = prefix.rstrip('/')
+        # Rewriting the full resolution store rewrites its levels, which live under its prefix
+        self._revalidate_store(prefix)
+        if point_budget is not None:
+            # The levels' metadata is small, the level is then chosen on the local copy
+            levels = [factor for factor in (1,) + tuple(PYRAMID_FACTORS)
+                      if self._exists(_level_key(prefix, factor, INDEX_FILE))]
+            for factor in levels[1:]:
+                self._revalidate_store(_level_key(prefix, factor))
+            self.fetch_many([_level_key(prefix, factor, name) for factor in levels for name in (INDEX_FILE,) + _AXES_FILES])
+            factor = choose_pyramid_level(self.local_path(prefix), point_budget, lat_range, lon_range)
+            prefix = _level_key(prefix, factor)
+        self.fetch_many([f'{prefix}/{name}' for name in (INDEX_FILE,) + _AXES_FILES])
+        store = open_store(self.local_path(prefix))
+        chunks = store.overlapping_chunks(time_slice(store.time, start_day, end_day))
+        self.fetch_many([f'{prefix}/{name}/{chunk_file_name(start)}' for name in variables for start, _ in chunks])
+        return store
+
+    def _revalidate_store(self, prefix):
+        """Drop the local copy of the store under `prefix` if its index changed in the bucket."""
+        path = self.local_path(f'{prefix}/{INDEX_FILE}')
+        if not os.path.isfile(path):
+            return
+        try:
+            etag = self.client.head_object(Bucket=self.bucket, Key=f'{prefix}/{INDEX_FILE}')['ETag']
+        except EndpointConnectionError:
+            # Offline, keep reading the local copy
+            return
+        try:
+            with open(f'{path}.etag') as f:
+                cached_etag = f.read()
+        except FileNotFoundError:
+            cached_etag = None
+        if cached_etag != etag:
+            # The index, axes and chunks are written together, so they are all stale
+            shutil.rmtree(self.local_path(prefix))
+
+    def _exists(self, key):
+        if os.path.isfile(self.local_path(key)):
+            return True
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError:
+            return False
+        return True
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+
+def _level_key(prefix, factor, name=None):
+    key = prefix if factor == 1 else f'{prefix}/{LEVELS_DIR}/{int(factor)}'
+    return key if name is None else f'{key}/{name}'
+
+
+def get_s3_loader(bucket=DEFAULT_BUCKET, endpoint_url=None):
+    """
+    Return the S3Loader of `bucket`, created once per process so its client and connections are reused.
+
+    The endpoint defaults to the SLR_S3_ENDPOINT_URL variable, then AWS.
+    """
+    return _s3_loader(bucket, endpoint_url or os.environ.get('SLR_S3_ENDPOINT_URL'))
+
+
+@functools.lru_cache(maxsize=None)
+def _s3_loader(bucket, endpoint_url):
+    return S3Loader(bucket=bucket, endpoint_url=endpoint_url)
@@ -0,0 +1,214 @@
+import functools
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from SLR_PP import STORE_PATHS, data_fingerprint, has_history, load_cube
+from SLR_store import LAND_FILL_VALUE, choose_pyramid_level, is_store, level_path, open_store
+from SLR_instrument import instrumented
+
+DEFAULT_BUFFER_KM = 150
+DEFAULT_PERCENTILES = (50, 90)
+INDEX_FILE = 'state_index.npz'
+STATE_INDEX_CACHE_DIR = os.path.join(
+    os.environ.get('SLR_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'slr')), 'state_index')
+_KM_PER_DEGREE_LAT = 110.57
+_KM_PER_DEGREE_LON = 111.32
+
+
+class StateIndex:
+    """
+    Precomputed mapping of the sea level grid cells to their nearest coastal state.
+
+    Parameters:
+    - latitude, longitude: Coordinate axes of the grid.
+    - cell_state: (lat, lon) array of indices into `states`, -1 for cells not linked to any state.
+    - states: Array of state codes (the GeoJSON feature ids).
+    """
+    def __init__(self, latitude, longitude, cell_state, states):
+        self.latitude = np.asarray(latitude)
+        self.longitude = np.asarray(longitude)
+        self.cell_state = np.asarray(cell_state, dtype=np.int16)
+        self.states = np.asarray(states)
+
+    def save(self, path):
+        np.savez(path, latitude=self.latitude, longitude=self.longitude,
+                 cell_state=self.cell_state, states=self.states)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(f['latitude'], f['longitude'], f['cell_state'], f['states'])
+
+    def states_of(self, latitude, longitude):
+        """State index (-1 for none) of every (latitude, longitude) point, which must lie on the grid."""
+        lat_idx = _axis_index(self.latitude, latitude)
+        lon_idx = _axis_index(self.longitude, longitude)
+        on_grid = (self.latitude[lat_idx] == latitude) & (self.longitude[lon_idx] == longitude)
+        return np.where(on_grid, self.cell_state[lat_idx, lon_idx], -1)
+
+    @instrumented('StateIndex.aggregate')
+    def aggregate(self, sea_df, column='Rate_of_Change', percentiles=DEFAULT_PERCENTILES):
+        """
+        Per state mean and percentiles of `column` over the rows of a processed DataFrame.
+
+        The zero-filled rows without n_days of history (see SLR_PP.has_history) are left out.
+
+        Parameters:
+        - sea_df: DataFrame with 'Latitude', 'Longitude' and `column` (e.g. the output of SLR_PP.PP_df).
+        - column: The column to aggregate. Defaults to 'Rate_of_Change'.
+        - percentiles: Percentiles to compute, with linear interpolation. Defaults to DEFAULT_PERCENTILES.
+
+        Returns:
+        - A DataFrame with one row per state that has samples: 'State', 'Samples', 'Mean_<column>'
+          and 'P<q>_<column>' for every percentile q.
+        """
+        state = self.states_of(sea_df['Latitude'].to_numpy(), sea_df['Longitude'].to_numpy())
+        values = sea_df[column].to_numpy(dtype=np.float64)
+        linked = (state >= 0) & ~np.isnan(values) & has_history(sea_df)
+        state, values = state[linked], values[linked]
+
+        counts = np.bincount(state, minlength=self.states.size)
+        present = np.flatnonzero(counts)
+        table = {'State': self.states[present], 'Samples': counts[present],
+                 f'Mean_{column}': np.bincount(state, weights=values, minlength=self.states.size)[present] / counts[present]}
+
+        # Percentiles from the values sorted by (state, value)
+        order = np.lexsort((values, state))
+        values = values[order]
+        starts = (np.cumsum(counts) - counts)[present]
+        sizes = counts[present]
+        for q in percentiles:
+            position = (sizes - 1) * q / 100
+            lower = np.floor(position).astype(np.int64)
+            upper = np.ceil(position).astype(np.int64)
+            low_value, high_value = values[starts + lower], values[starts + upper]
+            table[f'P{q}_{column}'] = low_value + (high_value - low_value) * (position - lower)
+        return pd.DataFrame(table)
+
+
+def _axis_index(axis, values):
+    order = np.argsort(axis)
+    position = np.clip(np.searchsorted(axis[order], values), 0, axis.size - 1)
+    return order[position]
+
+
+def build_state_index(latitude, longitude, ocean_mask=None, state_geo=None, buffer_km=DEFAULT_BUFFER_KM):
+    """
+    Link every ocean cell of a grid to the state with the nearest boundary vertex within `buffer_km`.
+
+    Distances use an equirectangular approximation, which is accurate to well under a grid cell at
+    these buffer sizes. The boundary vertices outside the grid's bounding box (widened by the
+    buffer) are dropped first, which only saves work: an inland state whose border comes within
+    `buffer_km` of a cell (e.g. across a bay or a lake) can still be its nearest.
+
+    Parameters:
+    - latitude, longitude: Coordinate axes of the grid.
+    - ocean_mask: (lat, lon) boolean array of the cells to link. Defaults to every cell.
+    - state_geo: US states GeoJSON. Defaults to SLR_visualization.load_state_geo().
+    - buffer_km: Maximum distance between a cell and its state's boundary. Defaults to DEFAULT_BUFFER_KM.
+
+    Returns:
+    - A StateIndex.
+    """
+    if state_geo is None:
+        from SLR_visualization import load_state_geo
+        state_geo = load_state_geo()
+    latitude = np.ma.getdata(latitude)
+    longitude = np.ma.getdata(longitude)
+    states, vertex_lon, vertex_lat, vertex_state = _boundary_vertices(state_geo)
+
+    buffer_lat = buffer_km / _KM_PER_DEGREE_LAT
+    buffer_lon = buffer_km / (_KM_PER_DEGREE_LON * max(np.cos(np.radians(np.abs(latitude).max())), 0.1))
+    near = ((vertex_lat >= latitude.min() - buffer_lat) & (vertex_lat <= latitude.max() + buffer_lat) &
+            (vertex_lon >= longitude.min() - buffer_lon) & (vertex_lon <= longitude.max() + buffer_lon))
+    vertex_lon, vertex_lat, vertex_state = vertex_lon[near], vertex_lat[near], vertex_state[near]
+
+    lon, lat = np.meshgrid(longitude, latitude)
+    if ocean_mask is None:
+        ocean_mask = np.ones(lat.shape, dtype=bool)
+    cells = np.flatnonzero(ocean_mask)
+    cell_state = np.full(lat.size, -1, dtype=np.int16)
+    if vertex_state.size and cells.size:
+        cell_lat, cell_lon = lat.ravel()[cells], lon.ravel()[cells]
+        # Chunk the cells so that the cell x vertex distance matrix stays around 4M entries
+        chunk = max(4_000_000 // vertex_state.size, 1)
+        for start in range(0, cells.size, chunk):
+            c_lat, c_lon = cell_lat[start:start + chunk, None], cell_lon[start:start + chunk, None]
+            dy = (c_lat - vertex_lat) * _KM_PER_DEGREE_LAT
+            dx = (c_lon - vertex_lon) * _KM_PER_DEGREE_LON * np.cos(np.radians(c_lat))
+            distance = dx ** 2 + dy ** 2
+            nearest = np.argmin(distance, axis=1)
+            within = distance[np.arange(nearest.size), nearest] <= buffer_km ** 2
+            cell_state[cells[start:start + chunk][within]] = vertex_state[nearest[within]]
+    return StateIndex(latitude, longitude, cell_state.reshape(lat.shape), states)
+
+
+def _boundary_vertices(state_geo):
+    states, lons, lats, ids = [], [], [], []
+    for feature in state_geo['features']:
+        geometry = feature['geometry']
+        polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+        state_id = len(states)
+        states.append(feature.get('id') or feature['properties'].get('name'))
+        for polygon in polygons:
+            for ring in polygon:
+                ring = np.asarray(ring, dtype=np.float64)
+                lons.append(ring[:, 0])
+                lats.append(ring[:, 1])
+                ids.append(np.full(len(ring), state_id, dtype=np.int16))
+    return np.asarray(states), np.concatenate(lons), np.concatenate(lats), np.concatenate(ids)
+
+
+def load_state_index(mode='east_coast', buffer_km=DEFAULT_BUFFER_KM, point_budget=None):
+    """
+    Return the StateIndex of the grid of `mode`, built once and saved in STATE_INDEX_CACHE_DIR.
+
+    The ocean cells are the ones with sea data on the first day of the record. With a
+    `point_budget`, the index is the one of the pyramid level SLR_PP.load_window_data reads
+    for the same budget, so it matches the coordinates of the data it aggregates. The saved
+    index is keyed by the version of the data (see SLR_PP.data_fingerprint), so re-ingesting
+    the store builds a new one, and the store itself is never written to.
+    """
+    version = data_fingerprint(mode)
+    # The arguments are passed positionally so that every call shares one cache entry
+    return _load_state_index(mode, version, _level_factor(mode, version, point_budget), buffer_km)
+
+
+@functools.lru_cache(maxsize=None)
+def _level_factor(mode, version, point_budget):
+    path = STORE_PATHS[mode]
+    if point_budget is None or not is_store(path):
+        return 1
+    return choose_pyramid_level(path, point_budget)
+
+
+@functools.lru_cache(maxsize=None)
+@instrumented('load_state_index', rows=None)
+def _load_state_index(mode, version, factor, buffer_km):
+    index_path = os.path.join(STATE_INDEX_CACHE_DIR, f'{mode}_{version}_{factor}_{buffer_km}km_{INDEX_FILE}')
+    if os.path.isfile(index_path):
+        return StateIndex.load(index_path)
+    path = STORE_PATHS[mode]
+    if is_store(path):
+        store = open_store(level_path(path, factor))
+        latitude, longitude = store.latitude, store.longitude
+        first_day = store.read('adt', slice(0, 1))
+    else:
+        cube = load_cube(mode=mode)
+        latitude, longitude, first_day = cube.latitude, cube.longitude, cube.adt[:1]
+    ocean_mask = np.ma.getdata(first_day)[0] > LAND_FILL_VALUE
+    index = build_state_index(latitude, longitude, ocean_mask, buffer_km=buffer_km)
+    # A read-only cache only costs rebuilding the index in the next process
+    try:
+        os.makedirs(STATE_INDEX_CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=STATE_INDEX_CACHE_DIR, suffix='.tmp')
+    except OSError:
+        return index
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            index.save(f)
+        os.replace(tmp_path, index_path)
+    except OSError:
+        os.remove(tmp_path)
+    return index
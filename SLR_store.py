@@ -0,0 +1,308 @@
+import base64
+import json
+import os
+import numpy as np
+import pandas as pd
+
+LAND_FILL_VALUE = -2.147484e+07
+STORE_VERSION = 1
+DEFAULT_CHUNK_TIME = 32
+INDEX_FILE = 'index.json'
+
+
+def write_store(path, data, variables=('adt',), chunk_time=DEFAULT_CHUNK_TIME, fill_value=LAND_FILL_VALUE):
+    """
+    Write a sea level dictionary to a time-chunked store.
+
+    The store is a directory holding the coordinate axes as .npy files, one sub-directory per
+    variable with one .npy block per `chunk_time` days, and a small 'index.json' describing
+    the shape, the chunk boundaries and the variables.
+
+    Parameters:
+    - path: Directory of the store (created if missing).
+    - data: Dictionary with 'time', 'latitude', 'longitude' and the (time, lat, lon) variables.
+    - variables: Names of the variables to write. Defaults to ('adt',).
+    - chunk_time: Number of days per chunk. Defaults to DEFAULT_CHUNK_TIME.
+    - fill_value: Value written where a variable is masked. Defaults to LAND_FILL_VALUE.
+
+    Returns:
+    - The path of the store.
+    """
+    n_times = len(data['time'])
+    chunks = [(start, min(start + chunk_time, n_times)) for start in range(0, n_times, chunk_time)]
+    write_axes(path, data['time'], data['latitude'], data['longitude'])
+    for name in variables:
+        for start, stop in chunks:
+            write_chunk(path, name, start, data[name][start:stop], fill_value=fill_value)
+    write_index(path, n_times, len(data['latitude']), len(data['longitude']),
+                {name: data[name].dtype for name in variables}, chunks, fill_value=fill_value)
+    return path
+
+
+def write_axes(path, time, latitude, longitude):
+    """Write the time, latitude and longitude axes of a store."""
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'time.npy'), np.asarray(time).astype('datetime64[ns]'))
+    np.save(os.path.join(path, 'latitude.npy'), np.ma.getdata(latitude))
+    np.save(os.path.join(path, 'longitude.npy'), np.ma.getdata(longitude))
+
+
+def write_chunk(path, name, start, values, fill_value=LAND_FILL_VALUE):
+    """Write one (time, lat, lon) block of variable `name` starting at time index `start`."""
+    directory = os.path.join(path, name)
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, chunk_file_name(start)), np.ma.filled(values, fill_value))
+
+
+def write_index(path, n_times, n_lat, n_lon, dtypes, chunks, fill_value=LAND_FILL_VALUE):
+    """
+    Write 'index.json', the metadata that makes the chunks written so far a readable store.
+
+    The index also keeps the (lat, lon) sea mask of the first chunk of the first variable, packed
+    in base64, so the cells to draw can be counted without reading any chunk (see `read_sea_mask`).
+    """
+    chunks = [[int(start), int(stop)] for start, stop in chunks]
+    index = {
+        'version': STORE_VERSION,
+        'shape': [int(n_times), int(n_lat), int(n_lon)],
+        'chunks': chunks,
+        'variables': {name: {'dtype': np.dtype(dtype).str, 'fill_value': float(fill_value)}
+                      for name, dtype in dtypes.items()},
+    }
+    if chunks and dtypes:
+        first = np.load(os.path.join(path, next(iter(dtypes)), chunk_file_name(min(chunks)[0])), mmap_mode='r')
+        sea_mask = (first > fill_value).any(axis=0)
+        index['sea_mask'] = base64.b64encode(np.packbits(sea_mask).tobytes()).decode('ascii')
+    tmp_path = os.path.join(path, INDEX_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, os.path.join(path, INDEX_FILE))
+
+
+def chunk_file_name(start):
+    return f'{int(start):08d}.npy'
+
+
+def is_store(path):
+    return os.path.isfile(os.path.join(path, INDEX_FILE))
+
+
+def read_sea_mask(path):
+    """Return the (lat, lon) sea mask kept in the index of the store at `path`, None for older stores."""
+    with open(os.path.join(path, INDEX_FILE)) as f:
+        index = json.load(f)
+    if 'sea_mask' not in index:
+        return None
+    _, n_lat, n_lon = index['shape']
+    packed = np.frombuffer(base64.b64decode(index['sea_mask']), dtype=np.uint8)
+    return np.unpackbits(packed, count=n_lat * n_lon).astype(bool).reshape(n_lat, n_lon)
+
+
+def store_fingerprint(path):
+    """
+    Version of the store at `path` for cache keys.
+
+    The index is written last (see `write_store`), so its modification time and size change
+    whenever the store is rewritten or extended.
+    """
+    stat = os.stat(os.path.join(path, INDEX_FILE))
+    return f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+
+def open_store(path):
+    """Open a store written by `write_store`. Only the index and the coordinate axes are read."""
+    return SLRStore(path)
+
+
+class SLRStore:
+    """
+    Read access to a time-chunked sea level store.
+
+    Only the chunks overlapping a requested window are memory mapped, and only the requested
+    bounding box of them is copied, so memory grows with the query rather than the archive.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        self.time = np.load(os.path.join(path, 'time.npy'))
+        self.latitude = np.load(os.path.join(path, 'latitude.npy'))
+        self.longitude = np.load(os.path.join(path, 'longitude.npy'))
+        self.chunks = np.asarray(self.index['chunks'], dtype=np.int64).reshape(-1, 2)
+        self.variables = self.index['variables']
+
+    @property
+    def shape(self):
+        return tuple(self.index['shape'])
+
+    def chunk_path(self, name, start):
+        return os.path.join(self.path, name, chunk_file_name(start))
+
+    def overlapping_chunks(self, t_slice):
+        """Return the (start, stop) rows of the chunks overlapping the time index slice."""
+        start, stop, _ = t_slice.indices(self.time.size)
+        overlap = (self.chunks[:, 0] < stop) & (self.chunks[:, 1] > start)
+        return self.chunks[overlap]
+
+    def read(self, name='adt', t_slice=slice(None), lat_slice=slice(None), lon_slice=slice(None)):
+        """
+        Read a (time, lat, lon) block of variable `name` by index slices.
+
+        Returns:
+        - A masked array, masked where the values are at or below the variable's fill value.
+        """
+        start, stop, _ = t_slice.indices(self.time.size)
+        n_lat = len(range(*lat_slice.indices(self.latitude.size)))
+        n_lon = len(range(*lon_slice.indices(self.longitude.size)))
+        meta = self.variables[name]
+        out = np.empty((max(stop - start, 0), n_lat, n_lon), dtype=np.dtype(meta['dtype']))
+        for chunk_start, chunk_stop in self.overlapping_chunks(slice(start, stop)):
+            lo, hi = max(start, chunk_start), min(stop, chunk_stop)
+            block = np.load(self.chunk_path(name, chunk_start), mmap_mode='r')
+            out[lo - start:hi - start] = block[lo - chunk_start:hi - chunk_start, lat_slice, lon_slice]
+        return np.ma.masked_array(out, mask=out <= meta['fill_value'])
+
+    def select(self, start_day=None, end_day=None, lat_range=None, lon_range=None, name='adt'):
+        """
+        Read a time window and bounding box of variable `name`.
+
+        Parameters:
+        - start_day, end_day: Inclusive window bounds in YYYY-MM-DD format (None for open ended).
+        - lat_range, lon_range: Inclusive (min, max) coordinate bounds (None for the full axis).
+        - name: The variable to read. Defaults to 'adt'.
+
+        Returns:
+        - Dictionary with the selected 'time', 'latitude', 'longitude' and `name` arrays.
+        """
+        t_slice = time_slice(self.time, start_day, end_day)
+        lat_slice = axis_slice(self.latitude, lat_range)
+        lon_slice = axis_slice(self.longitude, lon_range)
+        return {'time': self.time[t_slice],
+                'latitude': self.latitude[lat_slice],
+                'longitude': self.longitude[lon_slice],
+                name: self.read(name, t_slice, lat_slice, lon_slice)}
+
+
+def time_slice(time, start_day=None, end_day=None):
+    """Index slice of the ascending `time` axis between the inclusive start and end days."""
+    start = 0 if start_day is None else np.searchsorted(time, np.datetime64(pd.to_datetime(start_day)), side='left')
+    stop = time.size if end_day is None else np.searchsorted(time, np.datetime64(pd.to_datetime(end_day)), side='right')
+    return slice(int(start), int(stop))
+
+
+def axis_slice(axis, bounds=None):
+    """Index slice of the coordinate `axis` inside the inclusive (min, max) bounds."""
+    if bounds is None:
+        return slice(None)
+    lo, hi = min(bounds), max(bounds)
+    inside = np.flatnonzero((axis >= lo) & (axis <= hi))
+    if inside.size == 0:
+        return slice(0, 0)
+    return slice(int(inside[0]), int(inside[-1]) + 1)
+
+
+PYRAMID_FACTORS = (2, 4, 8)
+LEVELS_DIR = 'levels'
+
+
+def level_path(path, factor):
+    """Path of the pyramid level of the store at `path` coarsened by `factor` (1 is the store itself)."""
+    return path if factor == 1 else os.path.join(path, LEVELS_DIR, str(int(factor)))
+
+
+def pyramid_levels(path):
+    """Return the coarsening factors available for the store at `path`, finest first."""
+    levels_dir = os.path.join(path, LEVELS_DIR)
+    factors = [1]
+    if os.path.isdir(levels_dir):
+        factors += sorted(int(name) for name in os.listdir(levels_dir)
+                          if name.isdigit() and is_store(os.path.join(levels_dir, name)))
+    return factors
+
+
+def block_average(values, factor, fill_value=LAND_FILL_VALUE):
+    """
+    Average a (time, lat, lon) array over `factor` x `factor` spatial blocks.
+
+    Land entries (at or below `fill_value`) are left out of the averages, and blocks without any
+    sea cell are set to `fill_value`. Edge blocks average the cells they have.
+    """
+    values = np.ma.getdata(values)
+    n_times, n_lat, n_lon = values.shape
+    n_lat_blocks, n_lon_blocks = -(-n_lat // factor), -(-n_lon // factor)
+    padded = np.full((n_times, n_lat_blocks * factor, n_lon_blocks * factor), np.nan)
+    padded[:, :n_lat, :n_lon] = np.where(values > fill_value, values, np.nan)
+    blocks = padded.reshape(n_times, n_lat_blocks, factor, n_lon_blocks, factor)
+    sea = ~np.isnan(blocks)
+    count = sea.sum(axis=(2, 4))
+    total = np.where(sea, blocks, 0.0).sum(axis=(2, 4))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+    return np.where(count > 0, mean, fill_value).astype(values.dtype)
+
+
+def block_average_axis(axis, factor):
+    """Centre coordinate of every `factor` block of a coordinate axis."""
+    n_blocks = -(-axis.size // factor)
+    padded = np.full(n_blocks * factor, np.nan)
+    padded[:axis.size] = axis
+    return np.nanmean(padded.reshape(n_blocks, factor), axis=1).astype(axis.dtype)
+
+
+def build_pyramid(path, factors=PYRAMID_FACTORS):
+    """
+    Build block-averaged pyramid levels of every variable of the store at `path`.
+
+    Each level is itself a store under '<path>/levels/<factor>' with the same time chunks as the
+    base store, so it is read with `open_store` and converted chunk by chunk with bounded memory.
+    The n-day rate of change is linear in 'adt', so rate of change levels are obtained by running
+    the rate of change on the coarse 'adt' level.
+
+    Parameters:
+    - path: Directory of the base store.
+    - factors: Coarsening factors to build, e.g. (2, 4, 8) for 0.5, 1 and 2 degrees from a 0.25 degree grid.
+
+    Returns:
+    - The list of level paths.
+    """
+    store = open_store(path)
+    paths = []
+    for factor in factors:
+        out_path = level_path(path, factor)
+        latitude = block_average_axis(store.latitude, factor)
+        longitude = block_average_axis(store.longitude, factor)
+        write_axes(out_path, store.time, latitude, longitude)
+        for name, meta in store.variables.items():
+            for start, stop in store.chunks:
+                block = store.read(name, slice(start, stop))
+                write_chunk(out_path, name, start, block_average(block, factor, meta['fill_value']),
+                            fill_value=meta['fill_value'])
+        write_index(out_path, store.time.size, latitude.size, longitude.size,
+                    {name: meta['dtype'] for name, meta in store.variables.items()}, store.chunks)
+        paths.append(out_path)
+    return paths
+
+
+def choose_pyramid_level(path, point_budget, lat_range=None, lon_range=None):
+    """
+    Pick the pyramid level to render a bounding box of the store at `path` within `point_budget` sea cells.
+
+    Land cells are never drawn, so only the sea cells of the level's mask (see `read_sea_mask`) count;
+    every cell of the bounding box counts for stores written without a mask.
+
+    Returns:
+    - The finest coarsening factor whose grid has at most `point_budget` sea cells in the bounding box,
+      or the coarsest available level if none does.
+    """
+    factors = pyramid_levels(path)
+    for factor in factors:
+        level = level_path(path, factor)
+        latitude = np.load(os.path.join(level, 'latitude.npy'))
+        longitude = np.load(os.path.join(level, 'longitude.npy'))
+        lat_slice, lon_slice = axis_slice(latitude, lat_range), axis_slice(longitude, lon_range)
+        sea_mask = read_sea_mask(level)
+        if sea_mask is None:
+            sea_mask = np.ones((latitude.size, longitude.size), dtype=bool)
+        if np.count_nonzero(sea_mask[lat_slice, lon_slice]) <= point_budget:
+            return factor
+    return factors[-1]
@@ -1,12 +1,21 @@
+import functools
+import json
+import os
+import tempfile
 import plotly.graph_objects as go
 import plotly.express as pex
 import requests
 import pandas as pd
 import numpy as np
-from SLR_PP import PP_df
-state_geo = requests.get(
-    "https://raw.githubusercontent.com/python-visualization/folium-example-data/main/us_states.json"
-).json()
+from SLR_PP import PP_df, SLR_CACHE, data_fingerprint, has_history, load_cube, rate_of_change
+from SLR_store import LAND_FILL_VALUE, block_average, block_average_axis
+from SLR_instrument import instrumented
+
+STATE_GEO_URL = "https://raw.githubusercontent.com/python-visualization/folium-example-data/main/us_states.json"
+# Bundled copy next to this module; SLR_STATE_GEO_FILE points to another copy (e.g. on air-gapped nodes)
+STATE_GEO_FILE = os.environ.get('SLR_STATE_GEO_FILE',
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'us_states.json'))
+STATE_GEO_CACHE_DIR = os.environ.get('SLR_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'slr'))
 
 # def migrationSLRMap(state_data: dict, sea_df: pd.DataFrame, size_scaling_factor=10):
 #     if sea_df.empty:
@@ -66,10 +75,93 @@ def generate_figure(state_data, SLR_data, year, n_days, size_scaling_factor):
                           size_scaling_factor=size_scaling_factor)
     return fig
 
-def migrationSLRMap(state_data: dict, sea_df: pd.DataFrame, size_scaling_factor=10):
-    state_geo = requests.get(
-        "https://raw.githubusercontent.com/python-visualization/folium-example-data/main/us_states.json"
-    ).json()
+DEFAULT_POINT_BUDGET = 5000
+
+def load_state_geo(simplified=False):
+    """
+    Load the US states GeoJSON once per process.
+
+    The bundled file (STATE_GEO_FILE) is used when present, then the local cache in
+    STATE_GEO_CACHE_DIR. Only when neither exists is the file downloaded, and it is then written
+    to the cache so later processes do not need the network.
+
+    Parameters:
+    - simplified: Return the geometry with fewer polygon vertices (see `simplify_geojson`). Defaults to False.
+    """
+    # Passed positionally so that load_state_geo() and load_state_geo(simplified=False) share one entry
+    return _load_state_geo(bool(simplified))
+
+@functools.lru_cache(maxsize=None)
+@instrumented('load_state_geo', rows=lambda geo: len(geo['features']))
+def _load_state_geo(simplified):
+    if simplified:
+        return simplify_geojson(_load_state_geo(False))
+    cache_path = os.path.join(STATE_GEO_CACHE_DIR, 'us_states.json')
+    for path in (STATE_GEO_FILE, cache_path):
+        if os.path.isfile(path):
+            with open(path) as f:
+                return json.load(f)
+    response = requests.get(STATE_GEO_URL, timeout=30)
+    response.raise_for_status()
+    geo = response.json()
+    os.makedirs(STATE_GEO_CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=STATE_GEO_CACHE_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(geo, f)
+    os.replace(tmp_path, cache_path)
+    return geo
+
+def simplify_geojson(geo, tolerance=0.02):
+    """
+    Return a copy of a Polygon/MultiPolygon GeoJSON with Douglas-Peucker simplified rings.
+
+    Parameters:
+    - geo: GeoJSON FeatureCollection.
+    - tolerance: Maximum distance in degrees between a removed vertex and the simplified ring. Defaults to 0.02.
+    """
+    features = []
+    for feature in geo['features']:
+        geometry = feature['geometry']
+        if geometry['type'] == 'Polygon':
+            coordinates = [_simplify_ring(ring, tolerance) for ring in geometry['coordinates']]
+        elif geometry['type'] == 'MultiPolygon':
+            coordinates = [[_simplify_ring(ring, tolerance) for ring in polygon] for polygon in geometry['coordinates']]
+        else:
+            coordinates = geometry['coordinates']
+        features.append({**feature, 'geometry': {**geometry, 'coordinates': coordinates}})
+    return {**geo, 'features': features}
+
+def _simplify_ring(ring, tolerance):
+    points = np.asarray(ring, dtype=float)
+    if len(points) <= 4:
+        return ring
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last <= first + 1:
+            continue
+        inner = points[first + 1:last] - points[first]
+        chord = points[last] - points[first]
+        chord_length = np.hypot(*chord)
+        if chord_length == 0:
+            distance = np.hypot(inner[:, 0], inner[:, 1])
+        else:
+            distance = np.abs(chord[0] * inner[:, 1] - chord[1] * inner[:, 0]) / chord_length
+        farthest = int(np.argmax(distance))
+        if distance[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.extend([(first, split), (split, last)])
+    if keep.sum() < 4:
+        return ring
+    return points[keep].tolist()
+
+@instrumented(rows=None)
+def migrationSLRMap(state_data: dict, sea_df: pd.DataFrame, size_scaling_factor=10, point_budget=DEFAULT_POINT_BUDGET,
+                    simplified_geometry=False, state_table=None):
+    state_geo = load_state_geo(simplified=simplified_geometry)
     if sea_df.empty:
         print("The sea_df DataFrame is empty. Cannot generate the map.")
         return go.Figure()
@@ -93,6 +185,30 @@ def migrationSLRMap(state_data: dict, sea_df: pd.DataFrame, size_scaling_factor=
         marker_line_color='white',
         colorbar_title="Migration Change (%)"
     ))
+
+    # Per state sea level table (see SLR_spatial.StateIndex.aggregate) shown in the choropleth hover
+    if state_table is not None:
+        migration_df = migration_df.merge(state_table, how='left', left_on="States", right_on="State")
+        fig.update_traces(
+            customdata=migration_df[["Mean_Rate_of_Change", "P90_Rate_of_Change"]].to_numpy(),
+            hovertemplate="%{location}<br>Migration Change: %{z:.2f}%"
+                          "<br>Mean ADT Rate of Change: %{customdata[0]:.4f} m"
+                          "<br>P90 ADT Rate of Change: %{customdata[1]:.4f} m<extra></extra>",
+            selector=dict(type='choropleth'))
+
+    # Sea level overlay: one marker per grid cell, block averaged on the fly if the data is finer than the budget
+    cells = cell_rate_of_change(sea_df, point_budget)
+    fig.add_trace(go.Scattergeo(
+        lon=cells["Longitude"],
+        lat=cells["Latitude"],
+        mode='markers',
+        marker=dict(
+            size=np.maximum(np.abs(cells["Rate_of_Change"]) * size_scaling_factor, 1),
+            color=np.where(cells["Rate_of_Change"] > 0, 'blue', 'red'),
+            line_width=0
+        ),
+        name="ADT Rate of Change"
+    ))
     
     # Adjust map layout to focus on the United States
     fig.update_geos(
@@ -105,31 +221,201 @@ def migrationSLRMap(state_data: dict, sea_df: pd.DataFrame, size_scaling_factor=
     
     return fig
 
+@instrumented()
+def cell_rate_of_change(sea_df, point_budget=DEFAULT_POINT_BUDGET):
+    """
+    Average the 'Rate_of_Change' of a processed DataFrame per grid cell, with at most `point_budget` cells.
+
+    Data loaded from a pyramid level (see SLR_PP.load_cube) already fits the budget. Finer data is
+    block averaged on the fly over 2x2, 4x4, ... cell blocks until it does. The zero-filled rows
+    without n_days of history (see SLR_PP.has_history) are left out of the averages.
+
+    Returns:
+    - A DataFrame with 'Latitude', 'Longitude' and 'Rate_of_Change' columns, one row per (block of) cell(s).
+    """
+    if point_budget is None or point_budget < 1:
+        raise ValueError(f"point_budget must be a positive number of cells, got {point_budget!r}")
+    sea_df = sea_df[has_history(sea_df)]
+    cells = sea_df.groupby(['Latitude', 'Longitude'])['Rate_of_Change'].mean().reset_index()
+    if len(cells) <= point_budget:
+        return cells
+    latitude = cells['Latitude'].to_numpy()
+    longitude = cells['Longitude'].to_numpy()
+    steps = [np.diff(np.unique(axis)) for axis in (latitude, longitude)]
+    step = min([diffs.min() for diffs in steps if diffs.size] or [1.0])
+    factor = 1
+    coarse = cells
+    while len(coarse) > point_budget:
+        factor *= 2
+        lat_block = np.floor((latitude - latitude.min()) / (step * factor))
+        lon_block = np.floor((longitude - longitude.min()) / (step * factor))
+        coarse = cells.groupby([lat_block, lon_block]).mean().reset_index(drop=True)
+    return coarse
+
+@instrumented(rows=None)
 def infer_n_days(df):
     """
-    Infer the most common difference in days between consecutive time entries
-    in the DataFrame for each group of 'Latitude' and 'Longitude'.
+    Return the number of days between consecutive time entries of a processed DataFrame.
+
+    The cadence recorded by the preprocessing (SLR_PP.set_cadence) is used when present. Legacy
+    frames fall back to the most common difference between their sorted unique timestamps. The
+    DataFrame is not modified.
 
     Parameters:
-    - df: DataFrame containing the data with 'Time', 'Latitude', and 'Longitude' columns.
+    - df: DataFrame containing the data with a 'Time' column.
 
     Returns:
     - n_days: The most common time difference in days across the dataset, or None if not applicable.
     """
-    # Ensure 'Time' is in datetime format
-    df['Time'] = pd.to_datetime(df['Time'])
+    if 'n_days' in df.attrs:
+        return df.attrs['n_days']
+    times = np.unique(pd.to_datetime(df['Time']).to_numpy())
+    if times.size < 2:
+        return None
+    days, counts = np.unique(np.diff(times) // np.timedelta64(1, 'D'), return_counts=True)
+    return int(days[np.argmax(counts)])
 
-    # Sort the DataFrame
-    df.sort_values(by=['Latitude', 'Longitude', 'Time'], inplace=True)
+DEFAULT_ANIMATION_POINT_BUDGET = 2000
+ANIMATION_LEVELS = 15
 
-    # Calculate the difference in days between consecutive entries within each group
-    df['Time_Diff'] = df.groupby(['Latitude', 'Longitude'])['Time'].diff().dt.days
+@instrumented(rows=lambda frames: frames['codes'].size)
+def animation_frames(cube, n_days=1, point_budget=DEFAULT_ANIMATION_POINT_BUDGET, levels=ANIMATION_LEVELS):
+    """
+    Precompute the n-day rate of change of every frame of an animation as quantized codes on a fixed cell order.
+
+    Frames are the days PP_df selects for `n_days` (every n-th day of the window) on which at least
+    one cell has n_days of history, and the cells are the grid cells with sea data, ordered by
+    (Latitude, Longitude). Grids with more sea cells than
+    `point_budget` are block averaged over 2x2, 4x4, ... cell blocks until they fit; the rate of
+    change is linear in 'adt', so this is the block average of the rates.
+
+    Parameters:
+    - cube: SLRCube of the animated window (e.g. from SLR_PP.load_cube).
+    - n_days: The number of days between frames and over which the rate of change is calculated. Defaults to 1.
+    - point_budget: Maximum number of cells. Defaults to DEFAULT_ANIMATION_POINT_BUDGET.
+    - levels: Codes run from -levels to levels. Defaults to ANIMATION_LEVELS.
+
+    Returns:
+    - A dictionary with 'time' (frames), 'latitude' and 'longitude' (cells), 'codes' (int8, frames x
+      cells, 0 where a cell has no value) and 'scale', the rate of change of code `levels` in m.
+    """
+    adt = np.ma.getdata(cube.adt)
+    latitude, longitude = np.ma.getdata(cube.latitude), np.ma.getdata(cube.longitude)
+    # The factor is found on the 2D sea mask, so the cube is block averaged once
+    sea_mask = (adt > LAND_FILL_VALUE).any(axis=0)
+    factor = 1
+    while np.count_nonzero(block_average(sea_mask[None].astype(np.float32), factor, fill_value=0) > 0) > point_budget:
+        factor *= 2
+    coarse_adt, coarse_lat, coarse_lon = adt, latitude, longitude
+    if factor > 1:
+        coarse_adt = block_average(adt, factor)
+        coarse_lat, coarse_lon = block_average_axis(latitude, factor), block_average_axis(longitude, factor)
+
+    lon, lat = np.meshgrid(coarse_lon, coarse_lat)
+    sea = np.flatnonzero((coarse_adt > LAND_FILL_VALUE).any(axis=0).ravel())
+    sea = sea[np.lexsort((lon.ravel()[sea], lat.ravel()[sea]))]
+    cell, time_idx, _, rate = rate_of_change(coarse_adt.reshape(coarse_adt.shape[0], -1)[:, sea], n_days,
+                                             missing=np.nan)
+
+    frame_idx = np.unique(time_idx)
+    values = np.full((frame_idx.size, sea.size), np.nan, dtype=np.float32)
+    values[np.searchsorted(frame_idx, time_idx), cell] = rate
+    # The first days have no earlier day to difference with, so they would show as an all zero frame
+    with_history = ~np.isnan(values).all(axis=1)
+    frame_idx, values = frame_idx[with_history], values[with_history]
+
+    # Symmetric scale on the 99th percentile so a few extreme cells do not flatten the colours
+    finite = np.abs(values[~np.isnan(values)])
+    scale = float(np.percentile(finite, 99)) if finite.size else 0.0
+    scale = scale if scale > 0 else 1.0
+    codes = np.rint(np.clip(np.nan_to_num(values) / scale, -1, 1) * levels).astype(np.int8)
+    return {'time': cube.time[frame_idx], 'latitude': lat.ravel()[sea], 'longitude': lon.ravel()[sea],
+            'codes': codes, 'scale': scale}
+
+@instrumented(rows=lambda fig: len(fig.frames))
+def migrationSLRAnimation(state_data: dict, start_day, end_day, n_days=7, mode='east_coast', cube=None,
+                          point_budget=DEFAULT_ANIMATION_POINT_BUDGET, frame_duration=200, marker_size=6):
+    """
+    Animated map of the sea level rate of change over a multi-month window on top of the migration choropleth.
 
-    # Find the most common time difference
-    mode_series = df['Time_Diff'].mode()
-    if not mode_series.empty:
-        n_days = mode_series[0]
+    The cell coordinates are sent once with the first frame. Every Plotly frame only updates the
+    colours of the sea level markers, with the quantized codes of `animation_frames`, so a few
+    hundred frames stay small to build and to ship. The frames are cached in SLR_PP.SLR_CACHE.
+
+    Parameters:
+    - state_data: Dictionary of migration percentage per state.
+    - start_day, end_day: The animated window in YYYY-MM-DD format.
+    - n_days: The number of days between frames and over which the rate of change is calculated. Defaults to 7.
+    - mode: Dataset to animate, 'east_coast' or 'all_us'. Defaults to 'east_coast'.
+    - cube: SLRCube to animate instead of loading `mode` (the window is still applied).
+    - point_budget: Maximum number of sea level markers. Defaults to DEFAULT_ANIMATION_POINT_BUDGET.
+    - frame_duration: Milliseconds per frame during playback. Defaults to 200.
+    - marker_size: Size of the sea level markers. Defaults to 6.
+
+    Returns:
+    - A plotly Figure with one frame per time step and a play button and slider.
+    """
+    if cube is None:
+        key = ('animation', mode, data_fingerprint(mode), start_day, end_day, n_days, point_budget)
+        frames = SLR_CACHE.get_or_compute(key, lambda: animation_frames(
+            load_cube(mode=mode, start_day=start_day, end_day=end_day, point_budget=point_budget),
+            n_days, point_budget))
     else:
-        n_days = None  # Or set to a default value if appropriate
+        frames = animation_frames(cube.select(start_day, end_day), n_days, point_budget)
+    if frames['time'].size == 0:
+        print(f"No sea level data with {n_days} days of history in the window. Cannot generate the animation.")
+        return go.Figure()
 
-    return n_days
+    levels = ANIMATION_LEVELS
+    tick_codes = np.linspace(-levels, levels, 5)
+    fig = go.Figure([
+        go.Choropleth(
+            geojson=load_state_geo(simplified=True),
+            locations=list(state_data.keys()),
+            z=list(state_data.values()),
+            colorscale="Viridis",
+            marker_line_color='white',
+            colorbar=dict(title="Migration Change (%)", x=1.0)
+        ),
+        go.Scattergeo(
+            lon=frames['longitude'],
+            lat=frames['latitude'],
+            mode='markers',
+            marker=dict(
+                size=marker_size,
+                color=frames['codes'][0],
+                cmin=-levels, cmax=levels,
+                colorscale="RdBu",
+                colorbar=dict(title=f"ADT Rate of Change over {n_days} Days (m)", x=1.12,
+                              tickvals=tick_codes, ticktext=[f'{v:.3f}' for v in tick_codes / levels * frames['scale']]),
+                line_width=0
+            ),
+            hoverinfo='skip',
+            name="ADT Rate of Change"
+        ),
+    ])
+
+    # Frames only carry the marker colours of the sea level trace
+    names = pd.to_datetime(frames['time']).strftime('%Y-%m-%d')
+    fig.frames = [go.Frame(name=name, traces=[1], data=[go.Scattergeo(marker=dict(color=codes))])
+                  for name, codes in zip(names, frames['codes'])]
+
+    play = dict(frame=dict(duration=frame_duration, redraw=True), fromcurrent=True, transition=dict(duration=0))
+    fig.update_layout(
+        title=f'Sea Surface Height (ADT) Rate of Change over {n_days} Days in USA: {names[0]} to {names[-1]}',
+        geo=dict(bgcolor='rgba(0,0,0,0)'),
+        updatemenus=[dict(type='buttons', showactive=False, x=0.05, y=0, xanchor='right', yanchor='top', buttons=[
+            dict(label='Play', method='animate', args=[None, play]),
+            dict(label='Pause', method='animate', args=[[None], dict(frame=dict(duration=0, redraw=False), mode='immediate')]),
+        ])],
+        sliders=[dict(x=0.05, y=0, len=0.95, currentvalue=dict(prefix='Date: '), steps=[
+            dict(label=name, method='animate', args=[[name], dict(frame=dict(duration=0, redraw=True), mode='immediate')])
+            for name in names])]
+    )
+    fig.update_geos(
+        visible=False,
+        projection=dict(type="albers usa"),
+        lonaxis=dict(range=[-125, -65]),
+        lataxis=dict(range=[25, 50])
+    )
+    return fig
@@ -0,0 +1,210 @@
+"""
+Benchmarks of the SLR preprocessing and rendering hot paths on synthetic ADT cubes.
+
+Runs offline: the cubes, the NetCDF file and (unless --geo is given) the states geometry are
+generated. Every benchmark is timed over --repeat runs and memory profiled with tracemalloc in
+one extra run, and the results are written as JSON so runs of different commits can be compared:
+
+    python benchmarks/bench_slr.py --sizes small east_coast --output bench_results.json
+    python benchmarks/bench_slr.py --compare bench_results.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# (n_times, n_lat, n_lon, first day, first latitude, first longitude) on the 0.25 degree grid of the Copernicus product
+SIZES = {
+    'small': (60, 40, 40, '2021-01-01', 24.125, -90.875),
+    'east_coast_year': (365, 144, 212, '2021-01-01', 16.125, -101.875),
+    'east_coast': (888, 144, 212, '2021-01-01', 16.125, -101.875),
+    'all_us_multi_year': (4018, 136, 300, '2011-01-01', 20.125, -129.875),
+}
+# Value found under the land mask of the real product
+RAW_LAND_VALUE = -2.147483647e9
+STATE_CODES = ['AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'FL', 'GA', 'HI', 'ID', 'IL', 'IN', 'IA', 'KS', 'KY',
+               'LA', 'ME', 'MD', 'MA', 'MI', 'MN', 'MS', 'MO', 'MT', 'NE', 'NV', 'NH', 'NJ', 'NM', 'NY', 'NC', 'ND',
+               'OH', 'OK', 'OR', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI', 'WY']
+
+
+def make_slr_data(n_times, n_lat, n_lon, first_day, lat0=16.125, lon0=-101.875, seed=0):
+    """
+    Synthetic sea level dictionary shaped like the pickles of one_time_pp.
+
+    Land covers the continent between a wavy west and east coastline plus a few islands, and is
+    masked with the raw fill value of the product.
+    """
+    rng = np.random.default_rng(seed)
+    latitude = (lat0 + 0.25 * np.arange(n_lat)).astype(np.float32)
+    longitude = (lon0 + 0.25 * np.arange(n_lon)).astype(np.float32)
+    time = np.datetime64(first_day, 'D') + np.arange(n_times)
+    lon, lat = np.meshgrid(longitude, latitude)
+    east_coast = -81 - 10 * np.sin((lat - 16) / 36 * np.pi) + rng.normal(0, 0.5, lat.shape)
+    west_coast = -124 + 6 * np.sin((lat - 20) / 30 * np.pi) + rng.normal(0, 0.5, lat.shape)
+    land = (lon > west_coast) & (lon < east_coast)
+    for _ in range(max(n_lat * n_lon // 2000, 1)):
+        centre_lat, centre_lon = rng.uniform(latitude[0], latitude[-1]), rng.uniform(longitude[0], longitude[-1])
+        land |= (lat - centre_lat) ** 2 + (lon - centre_lon) ** 2 < rng.uniform(0.1, 1.0)
+    seasonal = 0.1 * np.sin(2 * np.pi * np.arange(n_times) / 365.25)[:, None, None]
+    adt = 0.5 + seasonal + rng.normal(0, 0.05, (n_times, n_lat, n_lon))
+    mask = np.broadcast_to(land, adt.shape)
+    adt[mask] = RAW_LAND_VALUE
+    return {'time': time.astype('datetime64[us]'),
+            'latitude': np.ma.masked_array(latitude),
+            'longitude': np.ma.masked_array(longitude),
+            'adt': np.ma.masked_array(adt, mask=mask.copy())}
+
+
+def write_netcdf(path, data):
+    """Write a synthetic dictionary as a NetCDF file laid out like the Copernicus SSH product."""
+    import netCDF4
+    with netCDF4.Dataset(path, 'w') as f:
+        f.createDimension('time', None)
+        f.createDimension('latitude', data['latitude'].size)
+        f.createDimension('longitude', data['longitude'].size)
+        time = f.createVariable('time', 'f8', ('time',))
+        time.units = 'days since 1950-01-01 00:00:00'
+        time.calendar = 'gregorian'
+        time[:] = (data['time'] - np.datetime64('1950-01-01')) / np.timedelta64(1, 'D')
+        f.createVariable('latitude', 'f4', ('latitude',))[:] = data['latitude']
+        f.createVariable('longitude', 'f4', ('longitude',))[:] = data['longitude']
+        adt = f.createVariable('adt', 'i4', ('time', 'latitude', 'longitude'), fill_value=-2147483647)
+        adt.scale_factor = 0.0001
+        adt[:] = data['adt']
+
+
+def write_state_geo(path):
+    """Write a grid of rectangular 'states' so figure construction can be benchmarked offline."""
+    features = []
+    for i, code in enumerate(STATE_CODES):
+        lon0, lat0 = -125 + 6 * (i % 10), 25 + 5 * (i // 10)
+        ring = [[lon0, lat0], [lon0 + 6, lat0], [lon0 + 6, lat0 + 5], [lon0, lat0 + 5], [lon0, lat0]]
+        features.append({'type': 'Feature', 'id': code, 'properties': {'name': code},
+                         'geometry': {'type': 'Polygon', 'coordinates': [ring]}})
+    with open(path, 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f)
+
+
+def measure(func, repeat):
+    """Time `func` over `repeat` runs, then run it once more under tracemalloc for the peak memory."""
+    seconds = []
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        result = func()
+        seconds.append(time.perf_counter() - tic)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds_min': min(seconds), 'seconds_median': float(np.median(seconds)), 'peak_mb': peak / 1e6,
+            'rows': len(result) if isinstance(result, pd.DataFrame) else None,
+            'payload_bytes': len(result) if isinstance(result, str) else None}
+
+
+def run(sizes, repeat, n_days, geo_path=None):
+    with tempfile.TemporaryDirectory(prefix='slr_bench_') as workdir:
+        if geo_path is None:
+            geo_path = os.path.join(workdir, 'us_states.json')
+            write_state_geo(geo_path)
+        os.environ['SLR_STATE_GEO_FILE'] = geo_path
+        import SLR_PP
+        import SLR_visualization
+        from SLR_store import write_store
+
+        results = []
+        for size in sizes:
+            n_times, n_lat, n_lon, first_day, lat0, lon0 = SIZES[size]
+            data = make_slr_data(n_times, n_lat, n_lon, first_day, lat0, lon0)
+            year = pd.Timestamp(first_day).year
+            start_day, end_day = f'{year}-01-01', f'{year}-12-31'
+            SLR_PP.STORE_PATHS['bench'] = write_store(os.path.join(workdir, f'store_{size}'), data)
+            cube = SLR_PP.load_cube(mode='bench', start_day=start_day, end_day=end_day)
+            long_df = cube.to_long()
+            processed = SLR_PP.PP_df(cube, start_day, end_day, n_days)
+            # Frames without the cadence attrs take infer_n_days' legacy inference from the timestamps
+            legacy = processed.copy()
+            legacy.attrs = {}
+            state_data = SLR_PP.get_state_data(2021)
+
+            benchmarks = {
+                'dic_to_pd': lambda: SLR_PP.dic_to_pd(year, mode='bench'),
+                'PP_df': lambda: SLR_PP.PP_df(cube, start_day, end_day, n_days),
+                'PP_df_long_frame': lambda: SLR_PP.PP_df(long_df, start_day, end_day, n_days),
+                'infer_n_days': lambda: SLR_visualization.infer_n_days(legacy),
+                'infer_n_days_attrs': lambda: SLR_visualization.infer_n_days(processed),
+                'migrationSLRMap': lambda: SLR_visualization.migrationSLRMap(state_data, processed).to_json(),
+                'migrationSLRAnimation': lambda: SLR_visualization.migrationSLRAnimation(
+                    state_data, start_day, end_day, n_days=7, cube=cube).to_json(),
+            }
+            try:
+                import netCDF4  # noqa: F401
+            except ImportError:
+                print("netCDF4 is not installed, skipping netCDF_2_pickle")
+            else:
+                from one_time_pp import netCDF_2_pickle
+                nc_path = os.path.join(workdir, f'{size}.nc')
+                write_netcdf(nc_path, data)
+                benchmarks['netCDF_2_pickle'] = lambda: netCDF_2_pickle(nc_path)
+
+            for name, func in benchmarks.items():
+                result = {'benchmark': name, 'size': size, 'shape': [n_times, n_lat, n_lon], **measure(func, repeat)}
+                print(f"{size:>18} {name:>21}: {result['seconds_min'] * 1e3:10.1f} ms  "
+                      f"{result['peak_mb']:9.1f} MB peak")
+                results.append(result)
+        return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'pandas': pd.__version__, 'platform': platform.platform(),
+            'cpu_count': os.cpu_count()}
+
+
+def compare(current, baseline):
+    """Print the time and memory ratio of every benchmark present in both result files."""
+    previous = {(r['benchmark'], r['size']): r for r in baseline['results']}
+    print(f"Compared with {baseline['environment'].get('commit')}:")
+    for result in current['results']:
+        before = previous.get((result['benchmark'], result['size']))
+        if before:
+            print(f"{result['size']:>18} {result['benchmark']:>21}: "
+                  f"time x{result['seconds_min'] / max(before['seconds_min'], 1e-12):.2f}  "
+                  f"memory x{result['peak_mb'] / max(before['peak_mb'], 1e-12):.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the SLR preprocessing and rendering hot paths.")
+    parser.add_argument('--sizes', nargs='+', default=['small', 'east_coast_year'], choices=list(SIZES))
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per benchmark.")
+    parser.add_argument('--n-days', type=int, default=30)
+    parser.add_argument('--geo', default=None, help="US states GeoJSON to use instead of the synthetic one.")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', default=None, help="Earlier results file to compare with.")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report = {'environment': environment(), 'results': run(args.sizes, args.repeat, args.n_days, args.geo)}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    if baseline:
+        compare(report, baseline)
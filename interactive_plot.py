@@ -2,84 +2,103 @@ import dash
 from dash import dcc, html
 from dash.dependencies import Input, Output, State
 import pandas as pd
-from SLR_PP import get_state_data, PP_df, netCDF_2_pd
-from SLR_visualization import migrationSLRMap
+from SLR_PP import load_initial_data
+from SLR_visualization import DEFAULT_POINT_BUDGET, migrationSLRMap
+from SLR_jobs import FigureJobs, DONE, FAILED, PENDING
+from SLR_instrument import ENABLED as INSTRUMENTED, format_report
 from datetime import date
+from uuid import uuid4
 import plotly.graph_objects as go 
 app = dash.Dash(__name__)
 
-def load_initial_data(year):
-    """Loads or computes data necessary for initializing the app or responding to user input."""
-    state_data = get_state_data(year=year)
-    slr_data_path = "C:/Users/Omar.khater/Desktop/SLR/data/c3s_obs-sl_glo_phy-ssh_my_twosat-l4-duacs-0.25deg_P1D_multi-vars_101.88W-49.12W_16.12N-51.88N_2021-01-01-2023-06-07.nc"
-    SLR_data = netCDF_2_pd(slr_data_path)
-    return state_data, SLR_data
-
-def generate_figure(state_data, SLR_data, year, n_days, size_scaling_factor):
-    """Generates the figure based on the provided data and parameters."""
-    SLR_data_pp = PP_df(SLR_data, 
-                        start_day=f'{year}-01-01', 
-                        end_day=f'{year}-01-15', 
-                        n_days=n_days)
-    fig = migrationSLRMap(state_data, 
-                          SLR_data_pp, 
-                          size_scaling_factor=size_scaling_factor)
-    return fig
-
 # Load initial data
 initial_year = 2021
-state_data_initial, SLR_data_initial = load_initial_data(initial_year)
-initial_fig = generate_figure(state_data_initial, SLR_data_initial, initial_year, 1, 10)
+# Read from the pyramid level that fits the map's point budget
+state_data_initial, SLR_data_initial = load_initial_data(initial_year, '2021-01-01', '2021-01-15', n_days=1,
+                                                         point_budget=DEFAULT_POINT_BUDGET)
+initial_fig = migrationSLRMap(state_data_initial, SLR_data_initial, size_scaling_factor=10)
+
+# Figures are built on a worker pool so a slow window never blocks the server
+figure_jobs = FigureJobs()
+
+def serve_layout():
+    # A layout function gives every page load its own session id
+    return html.Div([
+        dcc.Store(id='session-id', data=str(uuid4())),
+        dcc.Store(id='job-store'),
+        dcc.Interval(id='job-poll', interval=500, disabled=True),
 
-app.layout = html.Div([
-    html.Div([
-        html.Label('Start Date:'),
-        dcc.DatePickerSingle(
-            id='start-date-picker',
-            min_date_allowed=date(2021, 1, 1),
-            max_date_allowed=date.today(),
-            initial_visible_month=date.today(),
-            date=date(2021, 1, 1)  # Example default date
-        ),
-    ], style={'padding': 10}),
-    
-    html.Div([
-        html.Label('End Date:'),
-        dcc.DatePickerSingle(
-            id='end-date-picker',
-            min_date_allowed=date(1995, 1, 1),
-            max_date_allowed=date.today(),
-            initial_visible_month=date.today(),
-            date=date(2021, 12, 31)  # Example default date
-        ),
-    ], style={'padding': 10}),
-    
-    html.Div([
-        html.Label('Number of Days (n_days):'),
-        dcc.Input(
-            id='n-days-input',
-            type='number',
-            value=30,  # Default value
-            min=1, max=365, step=1
-        ),
-    ], style={'padding': 10}),
-    
-    html.Button('Update Map', id='update-button', n_clicks=0),
-    
-    dcc.Graph(id='migration-slr-map')
-])
+        html.Div([
+            html.Label('Start Date:'),
+            dcc.DatePickerSingle(
+                id='start-date-picker',
+                min_date_allowed=date(2021, 1, 1),
+                max_date_allowed=date.today(),
+                initial_visible_month=date.today(),
+                date=date(2021, 1, 1)  # Example default date
+            ),
+        ], style={'padding': 10}),
+        
+        html.Div([
+            html.Label('End Date:'),
+            dcc.DatePickerSingle(
+                id='end-date-picker',
+                min_date_allowed=date(1995, 1, 1),
+                max_date_allowed=date.today(),
+                initial_visible_month=date.today(),
+                date=date(2021, 12, 31)  # Example default date
+            ),
+        ], style={'padding': 10}),
+        
+        html.Div([
+            html.Label('Number of Days (n_days):'),
+            dcc.Input(
+                id='n-days-input',
+                type='number',
+                value=30,  # Default value
+                min=1, max=365, step=1
+            ),
+        ], style={'padding': 10}),
+        
+        html.Button('Update Map', id='update-button', n_clicks=0),
+        html.Div(id='job-status', style={'padding': 10}),
+        
+        dcc.Graph(id='migration-slr-map', figure=initial_fig),
+
+        # Per stage timings of the last map (set SLR_INSTRUMENT=1 to show it)
+        html.Div([
+            dcc.Checklist(
+                id='profile-request',
+                options=[{'label': 'Profile this request', 'value': 'profile'}],
+                value=[]
+            ),
+            html.Pre(id='debug-panel', style={'fontSize': 12}),
+        ], style={'padding': 10, 'display': 'block' if INSTRUMENTED else 'none'})
+    ])
+
+app.layout = serve_layout
 
 from dateutil import parser
 
 @app.callback(
-    Output('migration-slr-map', 'figure'),
-    [Input('update-button', 'n_clicks')],
+    [Output('migration-slr-map', 'figure'),
+     Output('job-store', 'data'),
+     Output('job-poll', 'disabled'),
+     Output('job-status', 'children'),
+     Output('debug-panel', 'children')],
+    [Input('update-button', 'n_clicks'),
+     Input('job-poll', 'n_intervals')],
     [State('start-date-picker', 'date'), 
      State('end-date-picker', 'date'),
-     State('n-days-input', 'value')]
+     State('n-days-input', 'value'),
+     State('profile-request', 'value'),
+     State('session-id', 'data'),
+     State('job-store', 'data')],
+    prevent_initial_call=True
 )
-def update_figure(n_clicks, start_date, end_date, n_days):
-    if n_clicks > 0:  # Only update the figure if the update button has been clicked
+def update_figure(n_clicks, n_intervals, start_date, end_date, n_days, profile, session_id, key):
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    if 'update-button.n_clicks' in triggered:
         # Convert start and end dates to tz-naive datetime objects
         start_date = parser.parse(start_date).replace(tzinfo=None)
         end_date = parser.parse(end_date).replace(tzinfo=None)
@@ -88,16 +107,22 @@ def update_figure(n_clicks, start_date, end_date, n_days):
         start_date_str = start_date.strftime('%Y-%m-%d')
         end_date_str = end_date.strftime('%Y-%m-%d')
 
-        # Load data for the selected year
-        year = start_date.year
-        state_data, SLR_data = load_initial_data(year=year)
-
-        # Generate and return the updated figure
-        return generate_figure(state_data, SLR_data, start_date_str, end_date_str, n_days)
-    else:
-        # Return an empty figure or a default figure before any update action
-        return initial_fig
+        # Identical requests from any session share one job, and this one supersedes the session's previous request
+        key = figure_jobs.submit(session_id, (start_date_str, end_date_str, int(n_days), 'profile' in (profile or [])))
+        return dash.no_update, list(key), False, 'Generating map...', dash.no_update
 
+    # Poll the session's job without holding the request while the figure is built
+    if not key:
+        return dash.no_update, dash.no_update, True, dash.no_update, dash.no_update
+    status, result = figure_jobs.poll(session_id, key)
+    if status == PENDING:
+        return dash.no_update, dash.no_update, False, dash.no_update, dash.no_update
+    if status == DONE:
+        figure, report = result
+        return go.Figure(figure), dash.no_update, True, '', format_report(report)
+    if status == FAILED:
+        return dash.no_update, dash.no_update, True, f'Map generation failed: {result}', dash.no_update
+    return dash.no_update, dash.no_update, True, '', dash.no_update
 
 if __name__ == '__main__':
     app.run_server(debug=True)
\ No newline at end of file
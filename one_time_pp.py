@@ -1,6 +1,15 @@
+import argparse
+import glob
+import os
+import time as timer
 import netCDF4
 import pickle as pk
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
+import pandas as pd
+from SLR_store import DEFAULT_CHUNK_TIME, PYRAMID_FACTORS, build_pyramid, write_axes, write_chunk, write_index
+
 def netCDF_2_pickle(path):
     directory = "/".join(path.split("/")[:-1])
     f = netCDF4.Dataset(path)
@@ -11,33 +20,240 @@ def netCDF_2_pickle(path):
     # Convert numeric time to datetime
     # This depends on the 'units' and 'calendar' attributes of the time variable
     time_units = f.variables['time'].units
-    time_calendar = f.variables['time'].calendar if hasattr(f.variables['time'], 'calendar') else 'standard'
-    time_datetimes = netCDF4.num2date(time, units=time_units, calendar=time_calendar)
-    time_units = f.variables['time'].units
-    try:
-        calendar = f.variables['time'].calendar
-    except AttributeError:  # In case the 'calendar' attribute is missing
-        calendar = 'gregorian'  # or 'standard', choose a default
-
+    calendar = getattr(f.variables['time'], 'calendar', 'gregorian')
 
     # Convert your numeric time values to numpy.datetime64 objects
     converted_times = convert_numeric_time_to_datetime64(time, time_units, calendar)
 
     adt = f.variables['adt'][:]
-    slr_data = {'latitude': latitude, 
-                'longitude': longitude, 
-                'time': converted_times, 
+    slr_data = {'latitude': latitude,
+                'longitude': longitude,
+                'time': converted_times,
                 'adt': adt}
     with (open(f"{directory}/slr_eastcost_21_23.pkl", "wb")) as openfile:
         pk.dump(slr_data, openfile)
-    return 
+    return
+
+_TIME_UNITS_NS = {'day': 86400 * 10**9, 'hour': 3600 * 10**9, 'minute': 60 * 10**9, 'second': 10**9}
+_GREGORIAN_CALENDARS = ('standard', 'gregorian', 'proleptic_gregorian')
 
 def convert_numeric_time_to_datetime64(time, units, calendar):
-    # Use netCDF4.num2date to convert numeric time values to datetime objects
-    cftime_objs = netCDF4.num2date(time, units=units, calendar=calendar)
-    
-    # Convert cftime objects to numpy.datetime64 objects
-    datetime64_objs = np.array([np.datetime64(date) for date in cftime_objs])
-    
-    return datetime64_objs
-netCDF_2_pickle("../data/c3s_obs-sl_glo_phy-ssh_my_twosat-l4-duacs-0.25deg_P1D_multi-vars_101.88W-49.12W_16.12N-51.88N_2021-01-01-2023-06-07.nc")
+    """
+    Convert numeric NetCDF time values ('<unit> since <epoch>') to a datetime64[ns] array in one vectorized step.
+
+    Calendars other than the Gregorian ones fall back to netCDF4.num2date.
+    """
+    match = re.match(r'\s*(day|hour|minute|second)s?\s+since\s+(.+)', units)
+    if match and calendar in _GREGORIAN_CALENDARS:
+        epoch = pd.Timestamp(match.group(2).strip())
+        if epoch.tzinfo is not None:
+            epoch = epoch.tz_convert(None)
+        offsets = np.rint(np.ma.getdata(time).astype(np.float64) * _TIME_UNITS_NS[match.group(1)])
+        return epoch.to_datetime64().astype('datetime64[ns]') + offsets.astype('timedelta64[ns]')
+    dates = netCDF4.num2date(time, units=units, calendar=calendar, only_use_cftime_datetimes=False,
+                             only_use_python_datetimes=True)
+    return np.asarray(dates, dtype='datetime64[ns]')
+
+def scan_netCDF(paths):
+    """
+    Read the coordinate axes of several NetCDF files and plan their combination into one time-ordered record.
+
+    Files are ordered by their first timestamp, and timestamps already covered by an earlier file
+    are dropped from the later one.
+
+    Parameters:
+    - paths: A path or list of paths of .nc files sharing the same latitude/longitude grid.
+
+    Returns:
+    - plan: List of (path, local_start, local_stop, global_start) tuples, one per file with new days.
+    - time: The combined datetime64[ns] time axis.
+    - latitude, longitude: The shared coordinate axes.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    files = []
+    latitude = longitude = None
+    for path in paths:
+        with netCDF4.Dataset(path) as f:
+            time_var = f.variables['time']
+            time = convert_numeric_time_to_datetime64(time_var[:], time_var.units,
+                                                      getattr(time_var, 'calendar', 'gregorian'))
+            lat = np.ma.getdata(f.variables['latitude'][:])
+            lon = np.ma.getdata(f.variables['longitude'][:])
+        if latitude is None:
+            latitude, longitude = lat, lon
+        elif not (np.array_equal(lat, latitude) and np.array_equal(lon, longitude)):
+            raise ValueError(f"{path} is not on the same latitude/longitude grid as {paths[0]}")
+        if time.size:
+            files.append((time[0], path, time))
+
+    plan = []
+    times = []
+    n_times = 0
+    last_time = None
+    for _, path, time in sorted(files, key=lambda item: item[0]):
+        local_start = 0 if last_time is None else int(np.searchsorted(time, last_time, side='right'))
+        if local_start == time.size:
+            continue
+        plan.append((path, local_start, time.size, n_times))
+        times.append(time[local_start:])
+        n_times += time.size - local_start
+        last_time = time[-1]
+    time = np.concatenate(times) if times else np.array([], dtype='datetime64[ns]')
+    return plan, time, latitude, longitude
+
+def stream_netCDF_blocks(path, local_start, local_stop, variables=('adt',), chunk_time=DEFAULT_CHUNK_TIME):
+    """Yield (offset, {variable: block}) pairs reading `chunk_time` days at a time from one NetCDF file."""
+    with netCDF4.Dataset(path) as f:
+        for start in range(local_start, local_stop, chunk_time):
+            stop = min(start + chunk_time, local_stop)
+            yield start - local_start, {name: f.variables[name][start:stop] for name in variables}
+
+def netCDF_2_store(paths, store_path=None, chunk_time=DEFAULT_CHUNK_TIME, variables=('adt',),
+                   pyramid=PYRAMID_FACTORS):
+    """
+    Stream one or more Copernicus SSH NetCDF files into the time-chunked store read by SLR_PP.load_cube.
+
+    The files are read `chunk_time` days at a time and every block is written straight to the store,
+    so peak memory depends on the grid and the chunk size, not on the length of the record.
+
+    Parameters:
+    - paths: A path or list of paths of .nc files (e.g. yearly downloads) sharing the same grid.
+    - store_path: Directory of the output store. Defaults to 'slr_eastcost_21_23' next to the first input file.
+    - chunk_time: Number of days per chunk. Defaults to DEFAULT_CHUNK_TIME.
+    - variables: Names of the variables to write. Defaults to ('adt',).
+    - pyramid: Coarsening factors of the block-averaged levels built after the conversion. Defaults to
+      PYRAMID_FACTORS; pass () to skip them.
+
+    Returns:
+    - The path of the store.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    if store_path is None:
+        store_path = "/".join(paths[0].split("/")[:-1] + ["slr_eastcost_21_23"])
+    plan, time, latitude, longitude = scan_netCDF(paths)
+    write_axes(store_path, time, latitude, longitude)
+
+    chunks = []
+    dtypes = {}
+    for path, local_start, local_stop, global_start in plan:
+        for offset, blocks in stream_netCDF_blocks(path, local_start, local_stop, variables, chunk_time):
+            start = global_start + offset
+            for name, block in blocks.items():
+                write_chunk(store_path, name, start, block)
+                dtypes[name] = block.dtype
+            chunks.append((start, start + len(block)))
+    write_index(store_path, time.size, latitude.size, longitude.size, dtypes, chunks)
+    build_pyramid(store_path, pyramid)
+    return store_path
+
+SSH_VARIABLES = ('adt', 'sla', 'ugos', 'vgos')
+
+def expand_sources(sources):
+    """Expand directories (all *.nc files inside), glob patterns and plain paths to a sorted list of .nc paths."""
+    if isinstance(sources, str):
+        sources = [sources]
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            paths.extend(glob.glob(os.path.join(source, '*.nc')))
+        elif glob.has_magic(source):
+            paths.extend(glob.glob(source))
+        else:
+            paths.append(source)
+    return sorted(set(paths))
+
+def _convert_block(path, local_start, local_stop, start, variables, store_path):
+    """Process pool worker: copy days [local_start, local_stop) of one file to the store at time index `start`."""
+    tic = timer.perf_counter()
+    n_bytes = 0
+    dtypes = {}
+    with netCDF4.Dataset(path) as f:
+        for name in variables:
+            block = f.variables[name][local_start:local_stop]
+            write_chunk(store_path, name, start, block)
+            n_bytes += block.nbytes
+            dtypes[name] = block.dtype
+    return path, local_stop - local_start, n_bytes, timer.perf_counter() - tic, dtypes
+
+def batch_netCDF_2_store(sources, store_path, chunk_time=DEFAULT_CHUNK_TIME, variables=SSH_VARIABLES,
+                         max_workers=None, pyramid=PYRAMID_FACTORS):
+    """
+    Convert many Copernicus SSH NetCDF files into one combined store on a process pool.
+
+    Every `chunk_time` block of every file is converted by its own worker and written at its position
+    in the combined time axis, and the index is written once all blocks are done.
+
+    Parameters:
+    - sources: Directory, glob pattern, path or list of them.
+    - store_path: Directory of the output store.
+    - chunk_time: Number of days per chunk. Defaults to DEFAULT_CHUNK_TIME.
+    - variables: Variables to convert; the ones missing from the files are skipped. Defaults to SSH_VARIABLES.
+    - max_workers: Number of worker processes. Defaults to every core.
+    - pyramid: Coarsening factors of the block-averaged levels built after the conversion. Defaults to
+      PYRAMID_FACTORS; pass () to skip them.
+
+    Returns:
+    - Dictionary of per-file statistics: {path: {'days', 'bytes', 'seconds'}}.
+    """
+    paths = expand_sources(sources)
+    if not paths:
+        raise ValueError(f"No NetCDF files found in {sources}")
+    plan, time, latitude, longitude = scan_netCDF(paths)
+    with netCDF4.Dataset(plan[0][0]) as f:
+        available = [name for name in variables if name in f.variables]
+    skipped = [name for name in variables if name not in available]
+    if skipped:
+        print(f"Variables {skipped} are not in {plan[0][0]} and are skipped")
+    write_axes(store_path, time, latitude, longitude)
+
+    stats = {path: {'days': 0, 'bytes': 0, 'seconds': 0.0} for path, _, _, _ in plan}
+    remaining = {}
+    chunks = []
+    dtypes = {}
+    tic = timer.perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+        futures = []
+        for path, local_start, local_stop, global_start in plan:
+            for start in range(local_start, local_stop, chunk_time):
+                stop = min(start + chunk_time, local_stop)
+                block_start = global_start + start - local_start
+                futures.append(pool.submit(_convert_block, path, start, stop, block_start, available, store_path))
+                chunks.append((block_start, block_start + stop - start))
+                remaining[path] = remaining.get(path, 0) + 1
+        for future in as_completed(futures):
+            path, n_days, n_bytes, seconds, block_dtypes = future.result()
+            dtypes.update(block_dtypes)
+            file_stats = stats[path]
+            file_stats['days'] += n_days
+            file_stats['bytes'] += n_bytes
+            file_stats['seconds'] += seconds
+            remaining[path] -= 1
+            if remaining[path] == 0:
+                mb = file_stats['bytes'] / 1e6
+                print(f"{path}: {file_stats['days']} days, {mb:.1f} MB in {file_stats['seconds']:.2f} s "
+                      f"({mb / max(file_stats['seconds'], 1e-9):.1f} MB/s)")
+    write_index(store_path, time.size, latitude.size, longitude.size, dtypes, sorted(chunks))
+    build_pyramid(store_path, pyramid)
+
+    elapsed = timer.perf_counter() - tic
+    total_mb = sum(file_stats['bytes'] for file_stats in stats.values()) / 1e6
+    print(f"Converted {len(plan)} files, {time.size} days, {total_mb:.1f} MB in {elapsed:.2f} s "
+          f"({total_mb / max(elapsed, 1e-9):.1f} MB/s)")
+    return stats
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert Copernicus SSH NetCDF files to the chunked SLR store.")
+    parser.add_argument('sources', nargs='*',
+                        default=["../data/c3s_obs-sl_glo_phy-ssh_my_twosat-l4-duacs-0.25deg_P1D_multi-vars_101.88W-49.12W_16.12N-51.88N_2021-01-01-2023-06-07.nc"],
+                        help="NetCDF files, directories or glob patterns.")
+    parser.add_argument('--store', default="../data/slr_eastcost_21_23", help="Output store directory.")
+    parser.add_argument('--chunk-time', type=int, default=DEFAULT_CHUNK_TIME, help="Days per chunk.")
+    parser.add_argument('--variables', nargs='+', default=list(SSH_VARIABLES), help="Variables to convert.")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: every core).")
+    parser.add_argument('--pyramid', type=int, nargs='*', default=list(PYRAMID_FACTORS),
+                        help="Coarsening factors of the pyramid levels (none to skip).")
+    args = parser.parse_args()
+    batch_netCDF_2_store(args.sources, args.store, chunk_time=args.chunk_time,
+                         variables=args.variables, max_workers=args.workers, pyramid=args.pyramid)
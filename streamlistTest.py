@@ -1,25 +1,37 @@
 import streamlit as st
 import pandas as pd
 from SLR_PP import load_initial_data
-from SLR_visualization import generate_figure
+from SLR_visualization import DEFAULT_POINT_BUDGET, migrationSLRMap
+from SLR_instrument import ENABLED as INSTRUMENTED, format_report, stage, trace
 from datetime import datetime
 
 # Load initial data
 initial_year = 2021
 # slr_data_path= "../data/slr_eastcost_21_23.pkl"
-state_data_initial, SLR_data_initial = load_initial_data(initial_year)
-initial_fig = generate_figure(state_data_initial, SLR_data_initial, initial_year, 1, 10)
+# Read from the pyramid level that fits the map's point budget
+state_data_initial, SLR_data_initial = load_initial_data(initial_year, '2021-01-01', '2021-01-15', n_days=1,
+                                                         point_budget=DEFAULT_POINT_BUDGET)
+initial_fig = migrationSLRMap(state_data_initial, SLR_data_initial, size_scaling_factor=10)
 
 st.title("Visualize US Internal Migration Patters Alongside Sea Level Rise")
 
 start_date = st.date_input("Start Date:", datetime(2021, 1, 1), min_value=datetime(2021, 1, 1), max_value=datetime.today())
 end_date = st.date_input("End Date:", datetime(2021, 12, 31), min_value=datetime(1995, 1, 1), max_value=datetime.today())
 n_days = st.number_input("Number of Days (n_days):", min_value=1, max_value=365, value=30, step=1)
+# Per stage timings of the map (set SLR_INSTRUMENT=1 to show them)
+profile = INSTRUMENTED and st.checkbox("Profile this request")
 
 if st.button("Update Map"):
     year = start_date.year
-    state_data, SLR_data = load_initial_data(year=year)
-    updated_fig = generate_figure(state_data, SLR_data, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'), n_days)
-    st.plotly_chart(updated_fig)
+    with trace('update_map', profile=profile) as request:
+        # Served from the shared SLR_PP cache on repeated queries
+        state_data, SLR_data_pp = load_initial_data(year, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'), n_days,
+                                                    point_budget=DEFAULT_POINT_BUDGET)
+        updated_fig = migrationSLRMap(state_data, SLR_data_pp, size_scaling_factor=10)
+        with stage('plotly_chart'):
+            st.plotly_chart(updated_fig)
+    if request is not None:
+        with st.expander("Debug: pipeline stages"):
+            st.code(format_report(request.to_dict()))
 else:
     st.plotly_chart(initial_fig)
\ No newline at end of file
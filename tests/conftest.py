@@ -0,0 +1,60 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The SLR modules are flat scripts at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from SLR_PP import SLRCube  # noqa: E402
+from SLR_store import LAND_FILL_VALUE, write_store  # noqa: E402
+
+LAND = -2.2e7
+
+
+def _make_cube(n_times=60, n_lat=6, n_lon=7, seed=0):
+    """Synthetic cube with permanent land cells and cells that are land on some days only."""
+    rng = np.random.default_rng(seed)
+    time = np.datetime64('2021-01-01') + np.arange(n_times)
+    latitude = (24.125 + 0.25 * np.arange(n_lat)).astype(np.float32)
+    longitude = (-80.875 + 0.25 * np.arange(n_lon)).astype(np.float32)
+    adt = rng.normal(0.5, 0.2, (n_times, n_lat, n_lon))
+    land = np.broadcast_to(rng.random((n_lat, n_lon)) < 0.25, adt.shape)
+    gaps = rng.random(adt.shape) < 0.05
+    adt[land | gaps] = LAND
+    return SLRCube(time, latitude, longitude, np.ma.masked_array(adt, mask=land | gaps))
+
+
+def _reference_PP_df(df, start_day, end_day, n_days):
+    """The per cell groupby implementation PP_df replaced."""
+    start_day, end_day = pd.to_datetime(start_day), pd.to_datetime(end_day)
+    sea_df = df[(df['adt'] > LAND_FILL_VALUE) & (df['Time'] >= start_day) & (df['Time'] <= end_day)].copy()
+    sea_df = sea_df.sort_values(by=['Latitude', 'Longitude', 'Time'])
+    groups = sea_df.groupby(['Latitude', 'Longitude'])
+    sea_df['Rate_of_Change'] = groups['adt'].diff(periods=n_days)
+    sea_df = sea_df[groups.cumcount() % n_days == n_days - 1]
+    sea_df['Has_History'] = sea_df['Rate_of_Change'].notna()
+    return sea_df.fillna(0).reset_index(drop=True)
+
+
+def _write_cube(path, cube, **kwargs):
+    """Write an SLRCube as a store, land as LAND."""
+    data = {'time': cube.time, 'latitude': cube.latitude, 'longitude': cube.longitude, 'adt': np.ma.getdata(cube.adt)}
+    return write_store(str(path), data, **kwargs)
+
+
+@pytest.fixture
+def make_cube():
+    return _make_cube
+
+
+@pytest.fixture
+def reference_PP_df():
+    return _reference_PP_df
+
+
+@pytest.fixture
+def write_cube():
+    return _write_cube
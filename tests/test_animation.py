@@ -0,0 +1,12 @@
+import numpy as np
+
+from SLR_visualization import animation_frames
+
+
+def test_frames_without_history_are_skipped(make_cube):
+    cube = make_cube(n_times=60)
+    for n_days in (1, 7):
+        frames = animation_frames(cube, n_days)
+        assert frames['time'][0] > cube.time[n_days - 1]
+        assert (frames['codes'] != 0).any(axis=1).all()
+        assert np.all(np.diff(frames['time']) > np.timedelta64(0))
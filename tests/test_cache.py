@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+
+import SLR_PP
+from SLR_PP import SLRCache, data_fingerprint, load_initial_data
+
+
+def test_reingested_store_is_not_served_from_the_cache(tmp_path, monkeypatch, make_cube, write_cube):
+    cache = SLRCache(disk_dir=str(tmp_path / 'cache'))
+    monkeypatch.setattr(SLR_PP, 'SLR_CACHE', cache)
+    monkeypatch.setitem(SLR_PP.STORE_PATHS, 'east_coast', write_cube(tmp_path / 'store', make_cube(seed=0)))
+    before = data_fingerprint()
+    _, first = load_initial_data(2021, '2021-01-01', '2021-02-28', 7)
+    assert len(os.listdir(tmp_path / 'cache')) == 1  # the rate frame, not the year cube
+
+    write_cube(tmp_path / 'store', make_cube(n_times=90, seed=1))
+    assert data_fingerprint() != before
+    _, second = load_initial_data(2021, '2021-01-01', '2021-02-28', 7)
+    assert cache.misses == 4 and cache.hits == 0
+    assert not first.equals(second)
+
+
+def test_memory_tier_evicts_least_recently_used_first():
+    cache = SLRCache(max_bytes=2500)
+    for key in 'ab':
+        cache.put(key, np.zeros(125))  # 1000 bytes each
+    assert cache.get('a') is not None  # 'b' is now the least recently used
+    cache.put('c', np.zeros(125))
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    cache.put('too_big', np.zeros(1000))
+    assert cache.get('too_big') is None
+    assert cache.stats() == {'hits': 3, 'disk_hits': 0, 'misses': 2, 'entries': 2, 'nbytes': 2000}
+
+
+def test_disk_tier_round_trip(tmp_path):
+    writer = SLRCache(disk_dir=str(tmp_path))
+    writer.put(('rate_of_change', 'east_coast', 7), np.arange(10.0))
+    writer.put(('cube', 'east_coast'), np.arange(5.0), disk=False)
+
+    reader = SLRCache(disk_dir=str(tmp_path))
+    np.testing.assert_array_equal(reader.get(('rate_of_change', 'east_coast', 7)), np.arange(10.0))
+    np.testing.assert_array_equal(reader.get(('rate_of_change', 'east_coast', 7)), np.arange(10.0))
+    assert reader.get(('cube', 'east_coast')) is None
+    assert (reader.hits, reader.disk_hits, reader.misses) == (1, 1, 1)
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_disk_tier_removes_the_oldest_files_over_budget(tmp_path):
+    cache = SLRCache(disk_dir=str(tmp_path), max_disk_bytes=25_000)
+    for i in range(5):
+        cache.put(i, np.zeros(1000))  # a little over 8 kB pickled
+        os.utime(cache._disk_path(i), (i, i))
+    cache.put(5, np.zeros(1000))
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(cache._disk_path(i)) for i in (3, 4, 5))
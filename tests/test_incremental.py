@@ -0,0 +1,25 @@
+import pandas as pd
+
+from SLR_PP import IncrementalRateOfChange, PP_df
+
+
+def test_windows_match_PP_df_within_the_memory_budget(make_cube):
+    cube = make_cube(n_times=200)
+    incremental = IncrementalRateOfChange(cube, block_days=16, max_bytes=200_000)
+    windows = [('2021-01-01', '2021-03-01'), ('2021-05-01', '2021-07-15'), ('2021-01-20', '2021-06-30')]
+    for n_days in (1, 3, 7, 30):
+        for window in windows:
+            pd.testing.assert_frame_equal(incremental.window(*window, n_days), PP_df(cube, *window, n_days))
+            assert incremental.nbytes <= 200_000
+
+
+def test_alternating_windows_reuse_blocks(make_cube):
+    cube = make_cube(n_times=200)
+    incremental = IncrementalRateOfChange(cube, block_days=16)
+    incremental.window('2021-01-01', '2021-02-15', 7)
+    incremental.window('2021-05-01', '2021-06-15', 7)
+    computed = incremental.blocks_computed
+    for _ in range(10):
+        incremental.window('2021-01-01', '2021-02-15', 7)
+        incremental.window('2021-05-01', '2021-06-15', 7)
+    assert incremental.blocks_computed == computed
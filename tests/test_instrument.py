@@ -0,0 +1,30 @@
+import threading
+
+import SLR_instrument
+from SLR_instrument import stage, trace
+
+
+def test_only_one_concurrent_request_records_memory(monkeypatch):
+    monkeypatch.setattr(SLR_instrument, 'TRACK_MEMORY', True)
+    both_started = threading.Barrier(2)
+    reports = {}
+
+    def request(name):
+        with trace(name, profile=True) as record:
+            both_started.wait()
+            with stage('allocate'):
+                bytearray(1_000_000)
+            both_started.wait()
+        reports[name] = record.to_dict()['stages'][0]['peak_mb']
+
+    threads = [threading.Thread(target=request, args=(name,)) for name in ('a', 'b')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(peak is not None for peak in reports.values()) == 1
+
+    with trace('after', profile=True) as record:
+        with stage('allocate'):
+            bytearray(1_000_000)
+    assert record.to_dict()['stages'][0]['peak_mb'] >= 1
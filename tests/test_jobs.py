@@ -0,0 +1,77 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from SLR_jobs import CANCELLED, DONE, FigureJobs, PENDING
+
+
+def test_sessions_are_forgotten_once_their_result_is_delivered():
+    release = threading.Event()
+    jobs = FigureJobs(build=lambda *key: release.wait() and key, max_workers=1)
+    keys = [jobs.submit(f'session-{i}', ('2021-01-01', '2021-02-01', 7)) for i in range(50)]
+    assert jobs.poll('session-0', keys[0]) == (PENDING, None)
+    release.set()
+    for i, key in enumerate(keys):
+        while jobs.poll(f'session-{i}', key)[0] == PENDING:
+            time.sleep(0.01)
+    assert jobs.poll('session-0', keys[0]) == (CANCELLED, None)
+    assert not (jobs._wanted or jobs._subscribers or jobs._last_seen)
+    jobs.shutdown()
+
+
+def test_idle_sessions_expire():
+    release = threading.Event()
+    jobs = FigureJobs(build=lambda *key: release.wait(), max_workers=1, session_ttl=0.05)
+    for i in range(50):
+        jobs.submit(f'session-{i}', ('2021-01-01', '2021-02-01', i))
+    time.sleep(0.1)
+    key = jobs.submit('last', ('2021-01-01', '2021-02-01', 0))
+    assert list(jobs._wanted) == ['last'] and list(jobs._subscribers) == [key]
+    release.set()
+    assert jobs.poll('last', key)[0] in (PENDING, DONE)
+    jobs.shutdown()
+
+
+def test_results_waiting_for_a_poll_are_not_pruned():
+    jobs = FigureJobs(build=lambda *key: key, max_workers=1, max_results=1)
+    key_a = jobs.submit('a', ('2021-01-01', '2021-02-01', 1))
+    while not jobs._jobs[key_a].done():
+        time.sleep(0.01)
+    key_b = jobs.submit('b', ('2021-01-01', '2021-02-01', 2))
+    while not jobs._jobs[key_b].done():
+        time.sleep(0.01)
+    jobs.submit('c', ('2021-01-01', '2021-02-01', 3))
+    assert jobs.poll('a', key_a) == (DONE, key_a)
+    assert jobs.poll('b', key_b) == (DONE, key_b)
+    jobs.shutdown()
+
+
+class _SupersedingExecutor:
+    """Runs jobs inline; reading the first job's outcome makes the session submit another key."""
+    def __init__(self):
+        self.jobs = None
+
+    def submit(self, build, *key):
+        future = Future()
+        if key[-1] == 1:
+            executor = self
+
+            class Superseded(Future):
+                def exception(self, timeout=None):
+                    executor.jobs.submit('a', ('2021-01-01', '2021-02-01', 2))
+                    return super().exception(timeout)
+            future = Superseded()
+            future.set_result(build(*key))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def test_poll_does_not_forget_a_newer_submission():
+    executor = _SupersedingExecutor()
+    jobs = executor.jobs = FigureJobs(build=lambda *key: key, executor=executor)
+    old = jobs.submit('a', ('2021-01-01', '2021-02-01', 1))
+    assert jobs.poll('a', old) == (CANCELLED, None)
+    assert jobs._wanted == {'a': ('2021-01-01', '2021-02-01', 2)}
+    assert not jobs._jobs[('2021-01-01', '2021-02-01', 2)].cancelled()
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from SLR_store import open_store
+
+netCDF4 = pytest.importorskip('netCDF4')
+from one_time_pp import batch_netCDF_2_store, netCDF_2_store, scan_netCDF  # noqa: E402
+
+
+def write_netcdf(path, cube, days):
+    """Write days `days` of an SLRCube as a Copernicus-like file: int32 'adt' scaled by 1e-4, land masked."""
+    with netCDF4.Dataset(path, 'w') as f:
+        f.createDimension('time', None)
+        f.createDimension('latitude', cube.latitude.size)
+        f.createDimension('longitude', cube.longitude.size)
+        time = f.createVariable('time', 'f8', ('time',))
+        time.units = 'days since 1950-01-01 00:00:00'
+        time.calendar = 'gregorian'
+        time[:] = (cube.time[days] - np.datetime64('1950-01-01')) / np.timedelta64(1, 'D')
+        f.createVariable('latitude', 'f4', ('latitude',))[:] = cube.latitude
+        f.createVariable('longitude', 'f4', ('longitude',))[:] = cube.longitude
+        adt = f.createVariable('adt', 'i4', ('time', 'latitude', 'longitude'), fill_value=-2147483647)
+        adt.scale_factor = 0.0001
+        adt[:] = cube.adt[days]
+    return str(path)
+
+
+@pytest.fixture
+def yearly_files(tmp_path, make_cube):
+    """Three files over 50 days; the second repeats days 15-19 of the first with other values."""
+    cube = make_cube(n_times=50)
+    overlap = make_cube(n_times=50, seed=1)
+    overlap.adt[20:] = cube.adt[20:]
+    directory = tmp_path / 'nc'
+    directory.mkdir()
+    paths = [write_netcdf(directory / 'c.nc', cube, slice(40, 50)),
+             write_netcdf(directory / 'b.nc', overlap, slice(15, 40)),
+             write_netcdf(directory / 'a.nc', cube, slice(0, 20))]
+    return cube, paths
+
+
+def assert_store_matches(store, cube):
+    np.testing.assert_array_equal(store.time, cube.time.astype('datetime64[ns]'))
+    adt = store.read()
+    np.testing.assert_array_equal(adt.mask, np.ma.getmaskarray(cube.adt))
+    np.testing.assert_allclose(adt.filled(0), np.round(cube.adt.filled(0), 4), atol=1e-6)
+
+
+def test_scan_netCDF_orders_files_and_drops_repeated_days(yearly_files):
+    cube, paths = yearly_files
+    plan, time, _, _ = scan_netCDF(paths)
+    assert [(path[-4:], start, stop, offset) for path, start, stop, offset in plan] == \
+        [('a.nc', 0, 20, 0), ('b.nc', 5, 25, 20), ('c.nc', 0, 10, 40)]
+    np.testing.assert_array_equal(time, cube.time.astype('datetime64[ns]'))
+
+
+def test_netCDF_2_store_merges_overlapping_files(tmp_path, yearly_files):
+    cube, paths = yearly_files
+    store = open_store(netCDF_2_store(paths, str(tmp_path / 'store'), chunk_time=8, pyramid=()))
+    assert_store_matches(store, cube)
+
+
+def test_batch_netCDF_2_store_matches_single_file_ingestion(tmp_path, yearly_files):
+    cube, paths = yearly_files
+    single = open_store(netCDF_2_store(paths, str(tmp_path / 'single'), chunk_time=8, pyramid=(2,)))
+    stats = batch_netCDF_2_store(str(tmp_path / 'nc'), str(tmp_path / 'batch'), chunk_time=8, max_workers=2,
+                                 pyramid=(2,))
+    assert sorted(file_stats['days'] for file_stats in stats.values()) == [10, 20, 20]
+    batch = open_store(str(tmp_path / 'batch'))
+    assert batch.index == single.index
+    assert_store_matches(batch, cube)
+    batch_level, single_level = (open_store(str(tmp_path / name / 'levels' / '2')) for name in ('batch', 'single'))
+    assert batch_level.index == single_level.index
+    np.testing.assert_array_equal(batch_level.read(), single_level.read())
@@ -0,0 +1,42 @@
+import pandas as pd
+import pytest
+
+from SLR_PP import PP_df
+
+
+@pytest.mark.parametrize('n_days', [1, 3, 7, 30])
+@pytest.mark.parametrize('window', [('2021-01-01', '2021-03-01'), ('2021-01-10', '2021-02-05')])
+@pytest.mark.parametrize('source', ['cube', 'long'])
+def test_matches_groupby_reference(n_days, window, source, make_cube, reference_PP_df):
+    cube = make_cube()
+    data = cube if source == 'cube' else cube.to_long()
+    expected = reference_PP_df(cube.to_long(), *window, n_days)
+    result = PP_df(data, *window, n_days)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+@pytest.mark.parametrize('n_days', [1, 7])
+def test_compact_matches_frame(n_days, make_cube):
+    cube = make_cube()
+    expected = PP_df(cube, '2021-01-01', '2021-03-01', n_days)
+    compact = PP_df(cube, '2021-01-01', '2021-03-01', n_days, compact=True)
+    pd.testing.assert_frame_equal(compact.to_frame(), expected, rtol=1e-6)
+    assert compact.to_frame().attrs == expected.attrs
+
+
+@pytest.mark.parametrize('source', ['cube', 'long'])
+@pytest.mark.parametrize('compact', [False, True])
+def test_empty_window(source, compact, make_cube):
+    cube = make_cube()
+    data = cube if source == 'cube' else cube.to_long()
+    result = PP_df(data, '2021-05-02', '2021-05-15', 3, compact=compact)
+    frame = result.to_frame() if compact else result
+    assert frame.empty
+    assert list(frame.columns) == ['Time', 'Latitude', 'Longitude', 'adt', 'Rate_of_Change', 'Has_History']
+    assert frame.attrs == {'n_days': 3, 'start_day': '2021-05-02', 'end_day': '2021-05-15'}
+
+
+def test_compact_frame_is_at_least_three_times_smaller(make_cube):
+    cube = make_cube(n_times=365, n_lat=20, n_lon=30)
+    compact = PP_df(cube, '2021-01-01', '2021-12-31', 1, compact=True)
+    assert compact.nbytes * 3 <= compact.to_frame().memory_usage(deep=True).sum()
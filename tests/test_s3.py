@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+import pytest
+
+from SLR_s3 import S3Loader
+
+moto = pytest.importorskip('moto')
+boto3 = pytest.importorskip('boto3')
+
+BUCKET = 'slr-test'
+PREFIX = 'slr/store'
+
+
+def upload_store(client, root):
+    for directory, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(directory, name)
+            client.upload_file(path, BUCKET, f"{PREFIX}/{os.path.relpath(path, root).replace(os.sep, '/')}")
+
+
+def cached_chunks(loader):
+    directory = loader.local_path(f'{PREFIX}/adt')
+    return sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+
+
+@pytest.fixture
+def s3(tmp_path):
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        loader = S3Loader(BUCKET, cache_dir=str(tmp_path / 'cache'), part_bytes=1024, client=client)
+        yield client, loader
+        loader.shutdown()
+
+
+def test_only_the_window_chunks_are_fetched(s3, tmp_path, make_cube, write_cube):
+    client, loader = s3
+    cube = make_cube(n_times=60)
+    upload_store(client, write_cube(tmp_path / 'store', cube, chunk_time=10))
+    store = loader.open_store(PREFIX, '2021-01-12', '2021-01-25')
+    assert cached_chunks(loader) == ['00000010.npy', '00000010.npy.etag', '00000020.npy', '00000020.npy.etag']
+    np.testing.assert_array_equal(store.select('2021-01-12', '2021-01-25')['adt'],
+                                  np.ma.getdata(cube.select('2021-01-12', '2021-01-25').adt))
+
+
+def test_a_repeated_window_downloads_nothing(s3, tmp_path, make_cube, write_cube):
+    client, loader = s3
+    upload_store(client, write_cube(tmp_path / 'store', make_cube(n_times=60), chunk_time=10))
+    loader.open_store(PREFIX, '2021-01-12', '2021-01-25')
+    downloaded = loader.bytes_downloaded
+    loader.open_store(PREFIX, '2021-01-12', '2021-01-25')
+    assert loader.bytes_downloaded == downloaded
+
+
+def test_a_changed_index_invalidates_the_local_store(s3, tmp_path, make_cube, write_cube):
+    client, loader = s3
+    upload_store(client, write_cube(tmp_path / 'store', make_cube(n_times=60, seed=0), chunk_time=10))
+    loader.open_store(PREFIX, '2021-01-01', '2021-01-05')
+    assert cached_chunks(loader)
+
+    cube = make_cube(n_times=80, seed=1)
+    upload_store(client, write_cube(tmp_path / 'store', cube, chunk_time=10))
+    loader._revalidate_store(PREFIX)
+    assert not os.path.exists(loader.local_path(PREFIX))
+    store = loader.open_store(PREFIX, '2021-01-01', '2021-01-05')
+    assert store.time.size == 80
+    np.testing.assert_array_equal(store.select('2021-01-01', '2021-01-05')['adt'],
+                                  np.ma.getdata(cube.select('2021-01-01', '2021-01-05').adt))
+
+
+def test_a_failed_range_leaves_no_partial_file(s3, tmp_path, make_cube, write_cube):
+    client, loader = s3
+    upload_store(client, write_cube(tmp_path / 'store', make_cube(n_times=60), chunk_time=10))
+    get_object = client.get_object
+
+    def flaky_get_object(**kwargs):
+        if kwargs['Key'].endswith('00000010.npy') and not kwargs['Range'].startswith('bytes=0-'):
+            raise ConnectionError('connection reset')
+        return get_object(**kwargs)
+
+    client.get_object = flaky_get_object
+    with pytest.raises(ConnectionError):
+        loader.open_store(PREFIX, '2021-01-12', '2021-01-25')
+    assert cached_chunks(loader) == []
+
+    client.get_object = get_object
+    loader.open_store(PREFIX, '2021-01-12', '2021-01-25')
+    assert cached_chunks(loader) == ['00000010.npy', '00000010.npy.etag', '00000020.npy', '00000020.npy.etag']
@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+import pytest
+
+import SLR_spatial
+import SLR_visualization
+from SLR_PP import SLRCube, PP_df, has_history
+from SLR_spatial import DEFAULT_BUFFER_KM, StateIndex, load_state_index
+from SLR_store import build_pyramid
+
+
+def test_aggregate_leaves_out_rows_without_history():
+    # Steady 0.01 m/day rise: every 7-day rate is 0.07, PP_df zero-fills the first sample of each cell
+    time = np.datetime64('2021-01-01') + np.arange(15)
+    latitude = np.array([25.125, 25.375], dtype=np.float32)
+    longitude = np.array([-80.125], dtype=np.float32)
+    adt = 0.5 + 0.01 * np.arange(15)[:, None, None] + np.zeros((15, 2, 1))
+    sea_df = PP_df(SLRCube(time, latitude, longitude, adt), '2021-01-01', '2021-01-15', 7)
+
+    index = StateIndex(latitude, longitude, np.zeros((2, 1)), np.array(['FL']))
+    table = index.aggregate(sea_df)
+    assert table['Samples'].tolist() == [2]
+    np.testing.assert_allclose(table[['Mean_Rate_of_Change', 'P50_Rate_of_Change']].to_numpy(), 0.07)
+
+
+def test_real_zero_changes_are_kept():
+    # A flat cell has a real 0 rate on every sample after its first, also once the rows are filtered
+    time = np.datetime64('2021-01-01') + np.arange(15)
+    latitude = np.array([25.125], dtype=np.float32)
+    longitude = np.array([-80.125], dtype=np.float32)
+    index = StateIndex(latitude, longitude, np.zeros((1, 1)), np.array(['FL']))
+    for compact in (False, True):
+        sea_df = PP_df(SLRCube(time, latitude, longitude, np.full((15, 1, 1), 0.5)), '2021-01-01', '2021-01-15', 1,
+                       compact=compact)
+        sea_df = sea_df.to_frame() if compact else sea_df
+        assert has_history(sea_df).tolist() == [False] + [True] * 14
+        later = sea_df[sea_df['Time'] > '2021-01-05']
+        assert has_history(later).all()
+        assert index.aggregate(later)['Samples'].tolist() == [10]
+
+
+def square_states(cube):
+    """One state bordering the west edge of the grid."""
+    lat0, lon0 = float(cube.latitude[0]), float(cube.longitude[0])
+    ring = [[lon0 - 1, lat0], [lon0 - 0.1, lat0], [lon0 - 0.1, lat0 + 2], [lon0 - 1, lat0 + 2], [lon0 - 1, lat0]]
+    return {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'id': 'FL', 'properties': {}, 'geometry': {'type': 'Polygon', 'coordinates': [ring]}}]}
+
+
+@pytest.fixture
+def state_index_store(tmp_path, monkeypatch, make_cube, write_cube):
+    cube = make_cube()
+    store = write_cube(tmp_path / 'store', cube)
+    build_pyramid(store, (2,))
+    monkeypatch.setitem(SLR_spatial.STORE_PATHS, 'east_coast', store)
+    monkeypatch.setattr(SLR_spatial, 'STATE_INDEX_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(SLR_visualization, 'load_state_geo', lambda: square_states(cube))
+    SLR_spatial._load_state_index.cache_clear()
+    yield store
+    SLR_spatial._load_state_index.cache_clear()
+
+
+def store_files(path):
+    return sorted(os.path.join(directory, name) for directory, _, names in os.walk(path) for name in names)
+
+
+def test_state_index_is_saved_in_the_cache_not_the_store(tmp_path, state_index_store, make_cube, write_cube):
+    before = store_files(state_index_store)
+    index = load_state_index()
+    coarse = load_state_index(point_budget=12)
+    assert load_state_index('east_coast', DEFAULT_BUFFER_KM) is index
+    assert store_files(state_index_store) == before
+    assert len(os.listdir(tmp_path / 'cache')) == 2
+    assert coarse.cell_state.shape == (3, 4) and index.cell_state.shape == (6, 7)
+    assert (index.cell_state == 0).any()
+
+    # A re-ingested store gets its own index
+    write_cube(state_index_store, make_cube(n_lat=4, n_lon=5))
+    assert load_state_index().cell_state.shape == (4, 5)
+    assert len(os.listdir(tmp_path / 'cache')) == 3
+
+
+def test_state_index_survives_an_unwritable_cache(tmp_path, state_index_store, monkeypatch):
+    (tmp_path / 'not_a_directory').write_text('')
+    monkeypatch.setattr(SLR_spatial, 'STATE_INDEX_CACHE_DIR', str(tmp_path / 'not_a_directory' / 'cache'))
+    assert load_state_index().cell_state.shape == (6, 7)
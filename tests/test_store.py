@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from SLR_PP import SLRCube
+from SLR_store import (LAND_FILL_VALUE, block_average, build_pyramid, choose_pyramid_level, level_path, open_store,
+                       pyramid_levels, read_sea_mask)
+from SLR_visualization import cell_rate_of_change
+
+
+def coastal_cube(n_times=40, n_lat=16, n_lon=16):
+    """Grid whose western three quarters are land."""
+    rng = np.random.default_rng(0)
+    time = np.datetime64('2021-01-01') + np.arange(n_times)
+    latitude = (24.125 + 0.25 * np.arange(n_lat)).astype(np.float32)
+    longitude = (-80.875 + 0.25 * np.arange(n_lon)).astype(np.float32)
+    adt = rng.normal(0.5, 0.2, (n_times, n_lat, n_lon))
+    adt[:, :, :n_lon * 3 // 4] = -2.2e7
+    return SLRCube(time, latitude, longitude, adt)
+
+
+def test_build_pyramid_levels_are_block_averages(tmp_path, write_cube):
+    cube = coastal_cube()
+    path = write_cube(tmp_path / 'store', cube, chunk_time=16)
+    build_pyramid(path, (2, 4))
+    assert pyramid_levels(path) == [1, 2, 4]
+    for factor in (2, 4):
+        level = open_store(level_path(path, factor))
+        assert level.shape == (40, 16 // factor, 16 // factor)
+        expected = block_average(cube.adt, factor)
+        np.testing.assert_allclose(np.ma.filled(level.read(), LAND_FILL_VALUE), expected, rtol=1e-6)
+        np.testing.assert_array_equal(read_sea_mask(level_path(path, factor)), (expected > LAND_FILL_VALUE).any(axis=0))
+
+
+def test_choose_pyramid_level_counts_sea_cells_only(tmp_path, write_cube):
+    path = write_cube(tmp_path / 'store', coastal_cube())
+    build_pyramid(path, (2, 4))
+    # 64 sea cells of 256 at full resolution, 16 at factor 2, 4 at factor 4
+    assert choose_pyramid_level(path, 64) == 1
+    assert choose_pyramid_level(path, 63) == 2
+    assert choose_pyramid_level(path, 10) == 4
+    assert choose_pyramid_level(path, 1) == 4
+    # Only the sea cells inside the bounding box count
+    assert choose_pyramid_level(path, 16, lat_range=(24, 25.1)) == 1
+
+
+@pytest.mark.parametrize('point_budget', [None, 0, -5])
+def test_cell_rate_of_change_rejects_invalid_budgets(point_budget):
+    sea_df = pd.DataFrame({'Latitude': [25.0], 'Longitude': [-80.0], 'Rate_of_Change': [0.1]})
+    with pytest.raises(ValueError):
+        cell_rate_of_change(sea_df, point_budget)
+
+
+@pytest.mark.parametrize('window', [(None, None), ('2021-01-05', '2021-01-20'), ('2021-01-08', '2021-01-08'),
+                                    ('2021-03-01', '2021-03-05')])
+@pytest.mark.parametrize('box', [(None, None), ((24.3, 25.0), (-80.6, -79.9))])
+def test_select_round_trips_the_written_cube(tmp_path, make_cube, write_cube, window, box):
+    cube = make_cube(n_times=30)
+    store = open_store(write_cube(tmp_path / 'store', cube, chunk_time=7))
+    selected = store.select(*window, *box)
+    expected = cube.select(*window, *box)
+    np.testing.assert_array_equal(selected['time'], expected.time)
+    np.testing.assert_array_equal(selected['latitude'], expected.latitude)
+    np.testing.assert_array_equal(selected['longitude'], expected.longitude)
+    np.testing.assert_array_equal(selected['adt'].mask, np.ma.getmaskarray(expected.adt))
+    np.testing.assert_array_equal(selected['adt'].filled(0), expected.adt.filled(0))
+
+
+def test_read_memory_maps_only_the_overlapping_chunks(tmp_path, make_cube, write_cube, monkeypatch):
+    store = open_store(write_cube(tmp_path / 'store', make_cube(n_times=30), chunk_time=7))
+    loads = []
+    load = np.load
+
+    def recording_load(path, *args, **kwargs):
+        loads.append((os.path.basename(path), kwargs.get('mmap_mode')))
+        return load(path, *args, **kwargs)
+
+    monkeypatch.setattr(np, 'load', recording_load)
+    adt = store.select('2021-01-06', '2021-01-16')['adt']
+    assert loads == [('00000000.npy', 'r'), ('00000007.npy', 'r'), ('00000014.npy', 'r')]
+    assert adt.shape[0] == 11 and not isinstance(adt.data, np.memmap)
@@ -0,0 +1,56 @@
+import json
+
+import numpy as np
+
+import SLR_visualization
+from SLR_visualization import load_state_geo, simplify_geojson
+
+
+def ring(n, radius=1.0, lon0=-80.0, lat0=27.0):
+    angle = np.linspace(0, 2 * np.pi, n)
+    points = np.column_stack([lon0 + radius * np.cos(angle), lat0 + radius * np.sin(angle)]).tolist()
+    points[-1] = points[0]
+    return points
+
+
+def test_simplify_geojson_keeps_ids_and_closed_rings():
+    square = [[-81, 25], [-80.99, 25], [-80.99, 25.01], [-81, 25.01], [-81, 25]]
+    sliver = [[-82, 26], [-81.999, 26.0001], [-81.998, 26], [-81.999, 25.9999], [-82, 26]]
+    geo = {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'id': 'FL', 'properties': {'name': 'Florida'},
+         'geometry': {'type': 'Polygon', 'coordinates': [ring(2000), ring(500, 0.3)]}},
+        {'type': 'Feature', 'id': 'GA', 'properties': {'name': 'Georgia'},
+         'geometry': {'type': 'MultiPolygon', 'coordinates': [[ring(800, 2, -84, 32)], [square], [sliver]]}},
+    ]}
+    simplified = simplify_geojson(geo)
+    assert [feature['id'] for feature in simplified['features']] == ['FL', 'GA']
+    assert [feature['properties'] for feature in simplified['features']] == \
+        [feature['properties'] for feature in geo['features']]
+    rings = simplified['features'][0]['geometry']['coordinates'] + \
+        [r for polygon in simplified['features'][1]['geometry']['coordinates'] for r in polygon]
+    assert len(rings) == 5
+    for simplified_ring in rings:
+        assert len(simplified_ring) >= 4
+        assert list(simplified_ring[0]) == list(simplified_ring[-1])
+    assert len(rings[0]) < 200
+    # The input is left untouched
+    assert len(geo['features'][0]['geometry']['coordinates'][0]) == 2000
+
+
+def test_load_state_geo_parses_the_file_once(tmp_path, monkeypatch):
+    path = tmp_path / 'us_states.json'
+    path.write_text(json.dumps({'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'id': 'FL', 'properties': {}, 'geometry': {'type': 'Polygon', 'coordinates': [ring(50)]}}]}))
+    monkeypatch.setattr(SLR_visualization, 'STATE_GEO_FILE', str(path))
+    loads = []
+    load = json.load
+    monkeypatch.setattr(json, 'load', lambda f: loads.append(f.name) or load(f))
+    SLR_visualization._load_state_geo.cache_clear()
+    try:
+        full = load_state_geo()
+        assert load_state_geo(simplified=False) is full
+        assert load_state_geo(False) is full
+        assert load_state_geo(simplified=True) is load_state_geo(True)
+        assert loads == [str(path)]
+    finally:
+        SLR_visualization._load_state_geo.cache_clear()